@@ -1,35 +1,102 @@
 """AMS hub platform."""
+import asyncio
 import logging
 import threading
-from copy import deepcopy
 import time
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
 
 import homeassistant.helpers.config_validation as cv
-import serial
 import voluptuous as vol
 from serial import SerialException
 from homeassistant.config_entries import ConfigEntry, SOURCE_IMPORT
-from homeassistant.core import Config, HomeAssistant
+from homeassistant.const import EVENT_HOMEASSISTANT_STARTED
+from homeassistant.core import Config, HomeAssistant, callback
+from homeassistant.helpers import entity_registry
 from homeassistant.helpers.dispatcher import async_dispatcher_send
+from homeassistant.helpers.event import async_track_time_interval
 from .const import (
-    LICZNIK_DEVICES,
+    CONF_ASYNC_ENGINE,
     CONF_SERIAL_PORT,
     CONF_METER_MANUFACTURER,
     CONF_BAUDRATE,
+    CONF_BUFFER_RETENTION,
+    CONF_CAPTURE_FILE,
+    CONF_DETECTED_PARSERS,
+    CONF_DEVICE_ADDRESSES,
+    CONF_FULL_READOUT_EVERY,
+    CONF_JITTER,
+    CONF_MAX_READOUT_TIME,
+    CONF_PUSH_BAUDRATE,
+    CONF_PUSH_MODE,
+    CONF_READ_COMMAND,
+    CONF_REGISTERS,
+    CONF_ROLLING_WINDOW,
+    CONF_SCAN_INTERVAL,
+    CONF_TRACE_SIZE,
+    DEFAULT_ASYNC_ENGINE,
     DEFAULT_BAUDRATE,
+    DEFAULT_BUFFER_RETENTION,
+    DEFAULT_FULL_READOUT_EVERY,
+    DEFAULT_JITTER,
+    DEFAULT_MAX_READOUT_TIME,
+    DEFAULT_PUSH_BAUDRATE,
+    DEFAULT_PUSH_MODE,
+    DEFAULT_READ_COMMAND,
+    DEFAULT_ROLLING_WINDOW,
+    DEFAULT_SCAN_INTERVAL,
     DEFAULT_METER_MANUFACTURER,
     DEFAULT_SERIAL_PORT,
     DEFAULT_TIMEOUT,
+    DEFAULT_TRACE_SIZE,
     DOMAIN,
     FRAME_FLAG,
+    PUSH_BAUDRATE_OPTIONS,
+    READ_COMMAND_OPTIONS,
+    SERVICE_DUMP_TRACE,
+    SIGNAL_CONNECTION_UPDATE,
+    SIGNAL_METRICS_UPDATE,
     SIGNAL_NEW_TELEGRAM_SENSOR,
     SIGNAL_UPDATE_TELEGRAM,
+    STOP_TIMEOUT,
     # Baudrates_Protocol_Mode_A,
     # Baudrates_Protocol_Mode_B,
 )
-from .parsers import EC3 as EC3
-from .parsers import NORAX30 as NORAX30
+from .capture import CaptureWriter, RecordingSerial, register_url_handlers
+from .iec62056 import (
+    ACTION_PROGRAMMING,
+    BREAK,
+    ETX,
+    FRAME_BAD,
+    FRAME_GOOD,
+    FRAME_TRUNCATED,
+    INITIAL_BAUDRATE,
+    INITIAL_BAUD_CHAR,
+    INTER_CHARACTER_TIMEOUT,
+    MAX_DEVICE_ADDRESS,
+    RESPONSE_TIMEOUT,
+    DataMessage,
+    PushDecoder,
+    SerialLineReader,
+    acknowledge,
+    check_identification,
+    is_end_of_data,
+    protocol_mode,
+    read_command,
+    register_line,
+    sign_on,
+    verify_block,
+)
+from .derived import DerivedMetrics
+from .metrics import ReadoutMetrics
+from .readings import Meter
+from .obis import parse_obis
+from .network import PORT_ERRORS, has_fixed_baudrate, open_port
+from .scheduler import ReadoutScheduler
+from .store import HOUR, ReadingStore, hourly_sums
+from .supervisor import ConnectionSupervisor
+from .trace import EVENT, RX, TX, ProtocolTrace
+from .timing import MARGIN, TR_MIN, response_timeout, transmit_time
+from .parsers import detect_parser, load_parser
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -42,6 +109,40 @@ CONFIG_SCHEMA = vol.Schema(
                     CONF_METER_MANUFACTURER, default=DEFAULT_METER_MANUFACTURER
                 ): cv.string,
                 vol.Optional(CONF_BAUDRATE, default=DEFAULT_BAUDRATE): cv.string,
+                vol.Optional(
+                    CONF_ASYNC_ENGINE, default=DEFAULT_ASYNC_ENGINE
+                ): cv.boolean,
+                vol.Optional(CONF_CAPTURE_FILE): cv.string,
+                vol.Optional(
+                    CONF_SCAN_INTERVAL, default=DEFAULT_SCAN_INTERVAL
+                ): cv.positive_int,
+                vol.Optional(CONF_JITTER, default=DEFAULT_JITTER): vol.Coerce(float),
+                vol.Optional(
+                    CONF_MAX_READOUT_TIME, default=DEFAULT_MAX_READOUT_TIME
+                ): cv.positive_int,
+                vol.Optional(CONF_REGISTERS, default=[]): vol.All(
+                    cv.ensure_list, [cv.string]
+                ),
+                vol.Optional(
+                    CONF_FULL_READOUT_EVERY, default=DEFAULT_FULL_READOUT_EVERY
+                ): cv.positive_int,
+                vol.Optional(CONF_READ_COMMAND, default=DEFAULT_READ_COMMAND): vol.In(
+                    READ_COMMAND_OPTIONS
+                ),
+                vol.Optional(CONF_DEVICE_ADDRESSES, default=[]): vol.All(
+                    cv.ensure_list, [vol.All(cv.string, vol.Length(max=MAX_DEVICE_ADDRESS))]
+                ),
+                vol.Optional(CONF_PUSH_MODE, default=DEFAULT_PUSH_MODE): cv.boolean,
+                vol.Optional(
+                    CONF_PUSH_BAUDRATE, default=DEFAULT_PUSH_BAUDRATE
+                ): vol.All(vol.Coerce(int), vol.In(PUSH_BAUDRATE_OPTIONS)),
+                vol.Optional(
+                    CONF_BUFFER_RETENTION, default=DEFAULT_BUFFER_RETENTION
+                ): cv.positive_int,
+                vol.Optional(
+                    CONF_ROLLING_WINDOW, default=DEFAULT_ROLLING_WINDOW
+                ): vol.All(vol.Coerce(int), vol.Range(min=1)),
+                vol.Optional(CONF_TRACE_SIZE, default=DEFAULT_TRACE_SIZE): cv.positive_int,
             }
         )
     },
@@ -49,80 +150,230 @@ CONFIG_SCHEMA = vol.Schema(
 )
 
 
-def _ustawienia(hass, config):
-    """Setup helper for the component."""
-    if DOMAIN not in hass.data:
-        hub = LiHub(hass, config)
-        hass.data[DOMAIN] = hub
+def _ustawienia(hass, config, config_entry):
+    """Setup helper for the component, one hub per config entry."""
+    hub = LiHub(hass, config, config_entry)
+    hass.data.setdefault(DOMAIN, {})[config_entry.entry_id] = hub
+    return hub
 
 
 async def async_setup(hass: HomeAssistant, config: Config) -> bool:
     """AMS hub YAML setup."""
-    # _ustawienia(hass, config[DOMAIN])
-    # if config.get(DOMAIN) is None:
-    #    _LOGGER.info("No YAML config available, using config_entries")
-    #    return True
-    _ustawienia(hass, config[DOMAIN])
-    if not hass.config_entries.async_entries(DOMAIN):
-        hass.async_create_task(
-            hass.config_entries.flow.async_init(
-                DOMAIN, context={"source": SOURCE_IMPORT}, data=config[DOMAIN]
-            )
+    hass.data.setdefault(DOMAIN, {})
+
+    async def async_dump_trace(call):
+        """Write the protocol trace of every hub to the configuration directory."""
+        for hub in list(hass.data[DOMAIN].values()):
+            path = hass.config.path("{}_trace_{}.json".format(DOMAIN, hub.hub_id))
+            await hass.async_add_executor_job(hub.trace.write, path)
+            _LOGGER.info("Protocol trace of %s written to %s", hub.hub_id, path)
+
+    hass.services.async_register(DOMAIN, SERVICE_DUMP_TRACE, async_dump_trace)
+    if config.get(DOMAIN) is None:
+        _LOGGER.info("No YAML config available, using config_entries")
+        return True
+    # the YAML meter becomes a config entry, its hub is created there
+    hass.async_create_task(
+        hass.config_entries.flow.async_init(
+            DOMAIN, context={"source": SOURCE_IMPORT}, data=config[DOMAIN]
         )
+    )
     return True
 
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Set up AMS as config entry."""
-    _ustawienia(hass, entry.data)
+    hub = _ustawienia(hass, entry.data, entry)
     hass.async_add_job(hass.config_entries.async_forward_entry_setup(entry, "sensor"))
+    if hub.store is not None:
+        hub.start_backfill()
     return True
 
 
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
-    """Unload a config entry."""
+    """Unload a config entry and stop reading its port."""
     await hass.config_entries.async_forward_entry_unload(entry, "sensor")
-    return True
-
-
-async def async_remove_entry(hass, entry) -> None:
-    """Handle removal of an entry."""
-    await hass.async_add_executor_job(hass.data[DOMAIN].stop_serial_read)
+    hub = hass.data[DOMAIN].pop(entry.entry_id, None)
+    if hub is not None:
+        await hub.async_stop_serial_read()
     return True
 
 
 class LiHub:
     """AmsHub wrapper for all sensors."""
 
-    def __init__(self, hass, entry):
+    def __init__(self, hass, entry, config_entry=None):
         """Initialize the AMS hub."""
         self._hass = hass
+        self.config_entry = config_entry
+        # entity and signal namespace of this meter
+        self.hub_id = config_entry.entry_id if config_entry is not None else entry[CONF_SERIAL_PORT]
+        # registers that already have a sensor entity
+        self.devices = set()
+        self.sensor_created_but_not_read = set()
+        # dispatcher listeners removed when the hub stops
+        self.listeners = []
         port = entry[CONF_SERIAL_PORT]
+        self._port = port
         _LOGGER.debug("Connecting to HAN using port %s", port)
-        parity = serial.PARITY_EVEN
         self.meter_manufacturer = entry.get(CONF_METER_MANUFACTURER)
+        # register name -> Reading of every meter on the port
         self.sensor_data = {}
-        self._attrs = {}
+        # an RS-485 bus is polled round-robin, one addressed sign-on per meter
+        self.meters = [Meter(address) for address in entry.get(CONF_DEVICE_ADDRESSES) or [""]]
+        # power values computed in the hub instead of template sensors
+        window = entry.get(CONF_ROLLING_WINDOW, DEFAULT_ROLLING_WINDOW)
+        for meter in self.meters:
+            meter.derived = DerivedMetrics(meter.identity, window)
+        self.frame_counters = {FRAME_GOOD: 0, FRAME_BAD: 0, FRAME_TRUNCATED: 0}
+        # timing of every readout cycle, shown by the diagnostic sensors
+        self.metrics = ReadoutMetrics()
+        # raw frames and events, dumped on demand instead of logged
+        self.trace = ProtocolTrace(entry.get(CONF_TRACE_SIZE, DEFAULT_TRACE_SIZE))
         self._running = True
-        self._ser = serial.Serial(
-            port=port,
-            baudrate=300,
-            parity=serial.PARITY_EVEN,
-            stopbits=serial.STOPBITS_ONE,
-            bytesize=serial.SEVENBITS,
-            timeout=DEFAULT_TIMEOUT,
+        self._wakeup = threading.Event()
+        self.scheduler = ReadoutScheduler(
+            entry.get(CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL),
+            entry.get(CONF_JITTER, DEFAULT_JITTER),
+            seed=port,
         )
-        # self.starthar = entry[SOH]
-        self.connection = threading.Thread(target=self.connect, daemon=True)
-        self.connection.start()
+        self.max_readout_time = entry.get(CONF_MAX_READOUT_TIME, DEFAULT_MAX_READOUT_TIME)
+        # registers read one by one in programming mode between full readouts
+        self.registers = list(entry.get(CONF_REGISTERS, []))
+        self.full_readout_every = entry.get(CONF_FULL_READOUT_EVERY, DEFAULT_FULL_READOUT_EVERY)
+        self.read_command = entry.get(CONF_READ_COMMAND, DEFAULT_READ_COMMAND).encode("ascii")
+        # listen only, the meter pushes its data messages unasked
+        self.push_mode = entry.get(CONF_PUSH_MODE, DEFAULT_PUSH_MODE)
+        self.push_baudrate = entry.get(CONF_PUSH_BAUDRATE, DEFAULT_PUSH_BAUDRATE)
+        # replay:// ports play back a capture instead of talking to a meter
+        register_url_handlers()
+        self.capture = None
+        if entry.get(CONF_CAPTURE_FILE):
+            self.capture = CaptureWriter(entry[CONF_CAPTURE_FILE])
+        # readings survive restarts and recorder outages here
+        self.store = None
+        retention = entry.get(CONF_BUFFER_RETENTION, DEFAULT_BUFFER_RETENTION)
+        if retention:
+            self.store = ReadingStore(
+                hass.config.path("{}_{}.db".format(DOMAIN, self.hub_id)), retention * 24 * HOUR
+            )
+        self._ser = None
+        self._reader = None
+        # the meter has to stay at the speed of a raw TCP port
+        self._fixed_baudrate = has_fixed_baudrate(port)
+        # set after a port error, the threaded reader reopens the port before the next cycle
+        self._reconnect = False
+        # connection state, reconnect count and backoff, shown by the connection sensors
+        self.supervisor = ConnectionSupervisor(port, seed=port)
+        self.connection = None
+        self._engine = None
+        self._engine_task = None
+        if entry.get(CONF_ASYNC_ENGINE, DEFAULT_ASYNC_ENGINE):
+            # Imported here so the threaded setup does not need serial_asyncio.
+            from .engine import AsyncReadoutEngine
+
+            self._engine = AsyncReadoutEngine(self, port)
+            if hasattr(hass, "async_create_background_task"):
+                # the engine never finishes, Home Assistant must not wait for it at startup
+                self._engine_task = hass.async_create_background_task(
+                    self._engine.run(), "{} readout {}".format(DOMAIN, port)
+                )
+            else:
+                self._engine_task = hass.async_create_task(self._engine.run())
+        else:
+            if len(self.meters) > 1:
+                _LOGGER.warning(
+                    "Multidrop polling needs the asyncio engine, reading only %s", self.meters[0].address
+                )
+            # the port is opened by the reader thread, a terminal server may take a while
+            # self.starthar = entry[SOH]
+            self.connection = threading.Thread(
+                target=self.listen if self.push_mode else self.connect, daemon=True
+            )
+            self.connection.start()
         _LOGGER.debug("Finish init of LICZNIK")
 
     def stop_serial_read(self):
         """Close resources."""
         _LOGGER.debug("stop_serial_read")
         self._running = False
+        self._wakeup.set()
         self.connection.join()
-        self._ser.close()
+        self._close_serial()
+        if self.capture is not None:
+            self.capture.close()
+        if self.store is not None:
+            self.store.close()
+
+    def _open_serial(self):
+        """Open the port for the threaded reader, return False if it cannot be reached."""
+        baudrate = self.push_baudrate if self.push_mode else INITIAL_BAUDRATE
+        self.supervisor.connecting()
+        self.connection_changed()
+        try:
+            # an adapter that came back may have another device name
+            ser = open_port(self.supervisor.resolve(), baudrate, DEFAULT_TIMEOUT)
+        except PORT_ERRORS as exc:
+            _LOGGER.warning("Cannot open serial device %s: %s", self._port, exc)
+            self.supervisor.failed(exc)
+            self.connection_changed()
+            return False
+        if self.capture is not None:
+            ser = RecordingSerial(ser, self.capture)
+        self._ser = ser
+        self._reader = SerialLineReader(ser)
+        self._reconnect = False
+        self.supervisor.connected()
+        self.connection_changed()
+        return True
+
+    def _close_serial(self):
+        """Close the port of the threaded reader."""
+        if self._ser is None:
+            return
+        ser, self._ser = self._ser, None
+        try:
+            ser.close()
+        except (SerialException, OSError):
+            pass
+
+    def _ensure_serial(self):
+        """Reopen the port after an error with backoff, keep it open otherwise."""
+        if self._reconnect:
+            _LOGGER.info("Reconnecting to %s", self._port)
+            self._close_serial()
+            self._reconnect = False
+        if self._ser is not None:
+            return True
+        # stop_serial_read cuts the backoff short
+        self._wakeup.wait(self.supervisor.delay())
+        return self._running and self._open_serial()
+
+    def _connection_failed(self, exc):
+        """Reopen the port before the next cycle."""
+        self._reconnect = True
+        self.supervisor.failed(exc)
+        self.connection_changed()
+
+    async def async_stop_serial_read(self):
+        """Stop whichever engine is reading the port."""
+        while self.listeners:
+            self.listeners.pop()()
+        if self._engine_task is None:
+            await self._hass.async_add_executor_job(self.stop_serial_read)
+            return
+        self._running = False
+        self._engine_task.cancel()
+        # the loops also end on _running, do not hang the unload if the cancel got lost
+        done, _ = await asyncio.wait({self._engine_task}, timeout=STOP_TIMEOUT)
+        if not done:
+            _LOGGER.warning("Readout of %s did not stop within %s s", self._port, STOP_TIMEOUT)
+        # the engine closes the port when it ends, close it here if it did not
+        self._engine.close()
+        if self.capture is not None:
+            self.capture.close()
+        if self.store is not None:
+            await self._hass.async_add_executor_job(self.store.close)
 
     def read_bytes(self):
         """Read the raw data from serial port."""
@@ -139,57 +390,360 @@ class LiHub:
             else:
                 continue
 
+    @property
+    def identity(self):
+        """Return the identity of the first meter on the port."""
+        return self.meters[0].identity
+
     @property
     def meter_serial(self):
-        return self._attrs["meter_serial"]
+        return self.identity.serial
 
     @property
     def meter_type(self):
-        return self._attrs["meter_type"]
+        return self.identity.type
+
+    def _detected_key(self, meter):
+        """Return the key of a meter in the detected parser map."""
+        if not meter.address:
+            return self._port
+        return "{}/{}".format(self._port, meter.address)
+
+    def select_parser(self, meter):
+        """Return the parser module for the configured meter, None if it still has to be detected."""
+        name = self.meter_manufacturer
+        if name == "auto":
+            # a meter detected on this port before skips detection
+            detected = self._detected_parsers().get(self._detected_key(meter))
+            if not isinstance(detected, dict):
+                # entries cached without the identification are detected again
+                return None
+            name = detected["parser"]
+            meter.identification = detected["identification"]
+        return load_parser(name)
+
+    def _detected_parsers(self):
+        """Return the port -> parser name and identification map cached in the config entry."""
+        if self.config_entry is None:
+            return {}
+        return self.config_entry.data.get(CONF_DETECTED_PARSERS, {})
+
+    def parser_for(self, meter, identification):
+        """Return the parser for an identification message, None if no parser matches."""
+        if meter.parser is not None:
+            if self.meter_manufacturer != "auto":
+                return meter.parser
+            text = identification.decode("ascii", "replace").strip()
+            if text == meter.identification:
+                return meter.parser
+            _LOGGER.info(
+                "Meter on %s now identifies as %s, detecting its parser again",
+                self._detected_key(meter),
+                text,
+            )
+        return self.detect_parser(meter, identification)
+
+    def detect_parser(self, meter, identification):
+        """Pick the parser matching the identification message and remember it."""
+        text = identification.decode("ascii", "replace").strip()
+        name = detect_parser(text)
+        if name is None:
+            _LOGGER.warning("No parser detected for identification %s", identification)
+            return None
+        _LOGGER.info("Detected %s meter on %s", name, self._detected_key(meter))
+        meter.identification = text
+        self._hass.add_job(self._async_remember_parser, self._detected_key(meter), name, text)
+        return load_parser(name)
+
+    @callback
+    def _async_remember_parser(self, key, name, identification):
+        """Cache the detected parser for this meter in the config entry."""
+        if self.config_entry is None:
+            return
+        detected = dict(self._detected_parsers())
+        detected[key] = {"parser": name, "identification": identification}
+        self._hass.config_entries.async_update_entry(
+            self.config_entry,
+            data={**self.config_entry.data, CONF_DETECTED_PARSERS: detected},
+        )
 
-    def connect(self):
-        """Read the data from the port."""
+    def registers_for_cycle(self, meter, mode):
+        """Return the registers to read in programming mode this cycle, None for a full data readout."""
+        cycle = meter.cycles
+        meter.cycles += 1
+        # only protocol mode C lets the reader pick the action in the ACK
+        if not self.registers or mode != 'C':
+            return None
+        if meter.registers is None:
+            if not meter.sensor_data:
+                # the addresses the meter uses are known after its first full readout
+                return None
+            meter.registers = self._resolve_registers(meter)
+        if cycle % self.full_readout_every == 0 or not meter.registers:
+            return None
+        return meter.registers
+
+    def _resolve_registers(self, meter):
+        """Return the configured registers under the addresses the meter uses in its full readout."""
+        codes = {}
+        channels = {}
+        for address in meter.sensor_data:
+            code = parse_obis(address)
+            if code is not None:
+                codes.setdefault(code, address)
+                channels.setdefault(code.channel, address)
+        registers = []
+        for address in self.registers:
+            code = parse_obis(address)
+            if code is None:
+                _LOGGER.warning("Register %s is not an OBIS code, not read", address)
+                continue
+            # 32.7.0 is read as 1-0:32.7.0, a second sensor for the same register would appear otherwise
+            resolved = codes.get(code) or channels.get(code.channel)
+            if resolved is None:
+                _LOGGER.warning(
+                    "Register %s is not in the full readout of %s, read as configured",
+                    address,
+                    meter.parser.__name__,
+                )
+                resolved = address
+            elif resolved != address:
+                _LOGGER.debug("Register %s is read as %s", address, resolved)
+            if resolved not in registers:
+                registers.append(resolved)
+        return registers
+
+    def handle_identification(self, meter, identification):
+        """Take the meter identity from the identification message."""
+        if self.trace.enabled:
+            self.trace.record(RX, identification, meter.address)
+        meter.parser.parse_identification(
+            meter.identity, identification.decode("ascii", "replace")
+        )
 
-        SOH = 0x01  # start of header
-        STX = 0x02  # start of text
-        ETX = 0x03  # end of text
-        ACK = 0x06  # acknowledge
-        CR = 0x0D  # carriage return
-        LF = 0x0A  # linefeed
-        BCC = 0x00  # Block check Character will contain the checksum immediately following the data packet
+    def handle_data_message(self, meter, message, status):
+        """Count the data message and publish it only if it arrived intact."""
+        self.frame_counters[status] += 1
+        if self.trace.enabled:
+            self.trace.record(RX, b"".join(message.lines), status)
+        if status != FRAME_GOOD:
+            _LOGGER.warning(
+                "Rejecting %s data message (%s lines), frames good/bad/truncated: %s",
+                status,
+                len(message.lines),
+                self.frame_counters,
+            )
+            return
+        started = time.perf_counter()
+        meter.sensor_data, changed = meter.parser.parse_telegram(
+            meter.sensor_data, message.lines, meter.identity
+        )
+        changed += meter.derived.update(meter.sensor_data)
+        self.metrics.observe("parse_time", time.perf_counter() - started)
+        changed = [meter.key(address) for address in changed]
+        for address in changed:
+            # new readings always count as changed
+            if address not in self.sensor_data:
+                register = address[len(meter.key("")):]
+                self.sensor_data[address] = meter.sensor_data[register]
+        if self.store is not None and changed:
+            self._buffer_readings(meter, changed)
+        # one hop onto the event loop per telegram
+        if self._engine is None:
+            self._hass.loop.call_soon_threadsafe(
+                self._check_for_new_sensors_and_update, meter, changed
+            )
+        else:
+            self._check_for_new_sensors_and_update(meter, changed)
+
+    def cycle_done(self, good, duration, received):
+        """Record a finished readout cycle and refresh the diagnostic sensors."""
+        self.metrics.cycle_done(good, duration, received)
+        if good:
+            self.supervisor.healthy()
+        _LOGGER.debug(
+            "Readout cycle %s after %s, %s bytes received",
+            "done" if good else "failed",
+            self.format_time(duration),
+            received,
+        )
+        self._send_signal(SIGNAL_METRICS_UPDATE.format(self.hub_id))
 
-        Baudrates_Protocol_Mode_A = 300
-        Baudrates_Protocol_Mode_B = {'A': 600, 'B': 1200, 'C': 2400, 'D': 4800, 'E': 9600, 'F': 19200,
-                                     'G': "reserved", 'H': "reserved", 'I': "reserved"}
-        Baudrates_Protocol_Mode_C = {'0': 300, '1': 600, '2': 1200, '3': 2400, '4': 4800, '5': 9600, '6': 19200,
-                                     '7': "reserved", '8': "reserved", '9': "reserved"}
+    def connection_changed(self):
+        """Refresh the connection sensors."""
+        self._send_signal(SIGNAL_CONNECTION_UPDATE.format(self.hub_id))
 
-        # always '3' but it is always initiated by the metering device so it can't be encountered here
-        Baudrates_Protocol_Mode_D = {'3': 2400}
-        Baudrates_Protocol_Mode_E = Baudrates_Protocol_Mode_C
+    def _send_signal(self, signal):
+        """Dispatch a signal from the engine, the threaded reader hops onto the event loop."""
+        if self._engine is None:
+            self._hass.loop.call_soon_threadsafe(async_dispatcher_send, self._hass, signal)
+        else:
+            async_dispatcher_send(self._hass, signal)
+
+    def _buffer_readings(self, meter, changed):
+        """Append the numeric registers that changed to the reading buffer."""
+        rows = []
+        for address in changed:
+            reading = self.sensor_data[address]
+            if not isinstance(reading.value, float):
+                continue
+            info = reading.info
+            cumulative = info is not None and info.state_class == "total_increasing"
+            rows.append((address, meter.identity.serial or "", reading.value, reading.unit, cumulative))
+        if not rows:
+            return
+        if self._engine is None:
+            self.store.append(time.time(), rows)
+        else:
+            # SQLite does not belong on the event loop
+            self._hass.async_add_executor_job(self.store.append, time.time(), rows)
 
-        InitialBaudrate = 300
-        wait_before_acknowledge = 0.4  # wait for 400 ms before sending the request to change baudrate
-        wait_after_acknowledge = 0.4  # wait for 400 ms after sending acknowledge
+    @callback
+    def start_backfill(self):
+        """Backfill statistics once Home Assistant runs and every hour after."""
 
-        parser = None
+        @callback
+        def _backfill(_now=None):
+            self._hass.async_create_task(self.async_backfill_statistics())
 
-        if self.meter_manufacturer == "auto":
-            """
-            while parser is None:
-                _LOGGER.info("Autodetecting meter manufacturer")
-                pkg = self.read_bytes()
-                self.meter_manufacturer = self._find_parser(pkg)
-                parser = self.meter_manufacturer
-            """
-            pass
+        if self._hass.is_running:
+            _backfill()
+        else:
+            # a store closed before the start has nothing to backfill
+            self._hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STARTED, _backfill)
+        self.listeners.append(
+            async_track_time_interval(self._hass, _backfill, timedelta(seconds=HOUR))
+        )
 
-        if self.meter_manufacturer == "ec3":
-            parser = EC3
-        if self.meter_manufacturer == "norax30":
-            parser = NORAX30
+    async def async_backfill_statistics(self):
+        """Import buffered energy readings for the hours the recorder has no statistics of."""
+        if "recorder" not in self._hass.config.components:
+            return
+        try:
+            from homeassistant.components.recorder import get_instance
+            from homeassistant.components.recorder.statistics import (
+                async_import_statistics,
+                get_last_statistics,
+            )
+        except ImportError:
+            _LOGGER.debug("Statistics import not available, buffered readings not backfilled")
+            return
+        registry = entity_registry.async_get(self._hass)
+        # the recorder compiles the hour that just ended itself
+        end = int(time.time()) // HOUR * HOUR - HOUR
+        registers = await self._hass.async_add_executor_job(self.store.cumulative_registers)
+        for name, serial_number, unit in registers:
+            entity_id = registry.async_get_entity_id("sensor", DOMAIN, "{}___{}".format(name, serial_number))
+            if entity_id is None:
+                continue
+            last = await get_instance(self._hass).async_add_executor_job(
+                get_last_statistics, self._hass, 1, entity_id, True, {"state", "sum"}
+            )
+            state, total, start = None, 0.0, 0
+            if last.get(entity_id):
+                row = last[entity_id][0]
+                start = row["start"]
+                if isinstance(start, datetime):
+                    start = start.timestamp()
+                state, total, start = row["state"], row["sum"] or 0.0, int(start) + HOUR
+            hours = await self._hass.async_add_executor_job(self.store.hourly, name, serial_number, start, end)
+            if not hours:
+                continue
+            _LOGGER.info("Backfilling %s hours of %s from the reading buffer", len(hours), entity_id)
+            async_import_statistics(
+                self._hass,
+                {
+                    "has_mean": False,
+                    "has_sum": True,
+                    "name": None,
+                    "source": "recorder",
+                    "statistic_id": entity_id,
+                    "unit_of_measurement": unit,
+                },
+                [
+                    {
+                        "start": datetime.fromtimestamp(hour, timezone.utc),
+                        "state": value,
+                        "sum": value_sum,
+                    }
+                    for hour, value, value_sum in hourly_sums(hours, state, total)
+                ],
+            )
 
+    def handle_push_frame(self, meter, identification, message, status):
+        """Publish a frame pushed by a mode D meter, return True if it was intact."""
+        error = check_identification(identification)
+        if error is not None:
+            _LOGGER.warning("%s, frame dropped", error)
+            return False
+        meter.parser = self.parser_for(meter, identification)
+        if meter.parser is None:
+            return False
+        self.handle_identification(meter, identification)
+        self.handle_data_message(meter, message, status)
+        return status == FRAME_GOOD
+
+    def listen(self):
+        """Decode the frames a mode D meter pushes."""
+        meter = self.meters[0]
+        meter.parser = self.select_parser(meter)
+        decoder = PushDecoder()
+        last = time.monotonic()
+        # every pushed frame counts as a readout cycle, timed from its first byte
+        started = None
+        received = 0
         while self._running:
+            if not self._ensure_serial():
+                continue
+            try:
+                data = self._ser.read(self._ser.in_waiting or 1)
+            except PORT_ERRORS as exc:
+                _LOGGER.warning("Error on serial device %s: %s", self._ser, exc)
+                self._connection_failed(exc)
+                decoder = PushDecoder()
+                started = None
+                received = 0
+                continue
+            now = time.monotonic()
+            if data:
+                last = now
+                if started is None:
+                    started = now
+                received += len(data)
+                frames = decoder.feed(data)
+            elif now - last > INTER_CHARACTER_TIMEOUT:
+                last = now
+                frame = decoder.timeout()
+                frames = [frame] if frame is not None else []
+            else:
+                continue
+            for identification, message, status in frames:
+                good = self.handle_push_frame(meter, identification, message, status)
+                self.cycle_done(good, now - (started or now), received)
+                started = None
+                received = 0
+            if not data:
+                # bytes the decoder dropped while resynchronizing are not a frame
+                started = None
+                received = 0
+
+    def connect(self):
+        """Read the data from the port."""
+
+        # protocol mode D is always initiated by the metering device, see listen()
+
+        meter = self.meters[0]
+        meter.parser = self.select_parser(meter)
+        self.scheduler.start(time.monotonic())
+
+        while self._running:
+            # sleep until the next sign-on is due, stop_serial_read wakes us up early
+            self._wakeup.wait(self.scheduler.delay(time.monotonic()))
+            if not self._running:
+                break
+            if not self._ensure_serial():
+                # the backoff of the supervisor paced the attempt
+                continue
             # try:
             """
             data = self.read_bytes()
@@ -200,267 +754,270 @@ class LiHub:
             else:
                 _LOGGER.debug("failed package: %s", data)
             """
-            starttime = time.time()
-            runtime = starttime
-            _LOGGER.info("Start While")
-            # _LOGGER.debug("Time to open serial port {}: {}".format(self._ser, self.format_time((5))))
-            # runtime = time.time()
-            _LOGGER.debug("Time to open serial port {}".format(self._ser))
-            self._ser.baudrate = InitialBaudrate
-            init_seq = bytes('/?!\r\n', 'ascii')
-
+            started = time.monotonic()
+            received = self._reader.received
             try:
-                self._ser.write(init_seq)
-            except SerialException as exc:
-                _LOGGER.exception("Error while write serial device %s: %s", self._ser, exc)
-                time.sleep(10)
-                continue
+                good = self._readout(meter)
+            except PORT_ERRORS as exc:
+                # an unplugged adapter fails anywhere, setting the baudrate included
+                _LOGGER.warning("Error on serial device %s: %s", self._port, exc)
+                self._connection_failed(exc)
+                good = False
+            except Exception:
+                # a meter sending nonsense must not end the readout for good
+                _LOGGER.exception("Readout of meter %s failed", meter.address or self._port)
+                good = False
+            self.cycle_done(good, time.monotonic() - started, self._reader.received - received)
+            if good:
+                self.scheduler.cycle_done(time.monotonic())
+            else:
+                self.scheduler.retry(time.monotonic())
 
-            ret = None
-            time.sleep(0.1)
-            ret = self.read_data_block_from_serial(end_byte=10)
+        _LOGGER.debug("Koniec pętli Pełnego odczytu danych")
 
-            if ret is None:
-                _LOGGER.debug("Brak odpowiedzi na first request")
-                time.sleep(10)
-                continue
+    def _readout(self, meter):
+        """Run one sign-on and data readout cycle, return True if a data message was read."""
+        _LOGGER.debug("Start While")
+        self._ser.baudrate = INITIAL_BAUDRATE
 
-            Identification_Message = ret
-            _LOGGER.debug("Identification Message is {}".format(Identification_Message))
-
-            # need at least 7 bytes:
-            # 1 byte "/"
-            # 3 bytes short Identification
-            # 1 byte speed indication
-            # 2 bytes CR LF
-            if (len(Identification_Message) < 7):
-                _LOGGER.warning("malformed identification message: '{}', abort query".format(Identification_Message))
-                time.sleep(10)
-                continue
+        request = sign_on(meter.address)
+        try:
+            self._reader.reset()
+            sent = time.monotonic()
+            self._write(request)
+        except SerialException as exc:
+            _LOGGER.exception("Error while write serial device %s: %s", self._ser, exc)
+            self._connection_failed(exc)
+            return False
 
-            if (Identification_Message[0] != 47):
-                _LOGGER.warning("identification message '{}' does not start with '/',"
-                                "abort query, start with: {} , SOH = {}".format(Identification_Message,
-                                                                                Identification_Message[0],
-                                                                                str(SOH)))
-                time.sleep(10)
-                continue
+        ret = self.read_data_block_from_serial(
+            end_byte=10, timeout=response_timeout(len(request), INITIAL_BAUDRATE)
+        )
 
-            try:
-                manid = str(Identification_Message[1:4], 'ascii')
-            except:
-                manid = " "
+        if ret is None:
+            _LOGGER.debug("Brak odpowiedzi na first request")
+            if self.trace.enabled:
+                self.trace.record(EVENT, note="no identification")
+            return False
+        received = time.monotonic()
+        meter.timing.observe_response(
+            self._reader.first_byte_at - sent - transmit_time(len(request), INITIAL_BAUDRATE)
+        )
+        self.metrics.observe("sign_on_latency", self._reader.first_byte_at - sent)
+        # modes A and B answer without an ACK, time their data from here
+        self._reader.mark()
 
-            try:
-                modelid = str(Identification_Message[6:8], 'ascii')
-            except:
-                modelid = " "
-
-            Baudrate_identification = chr(Identification_Message[4])
-            # Baudrate_identification = '0'
-
-            if Baudrate_identification in Baudrates_Protocol_Mode_B:
-                NewBaudrate = Baudrates_Protocol_Mode_B[Baudrate_identification]
-                Protocol_Mode = 'B'
-            elif Baudrate_identification in Baudrates_Protocol_Mode_C:
-                NewBaudrate = Baudrates_Protocol_Mode_C[Baudrate_identification]
-                Protocol_Mode = 'C'  # could also be 'E' but it doesn't make any difference here
-            else:
-                NewBaudrate = Baudrates_Protocol_Mode_A
-                Protocol_Mode = 'A'
+        Identification_Message = ret
+        _LOGGER.debug("Identification Message is %s", Identification_Message)
+
+        error = check_identification(Identification_Message)
+        if error is not None:
+            _LOGGER.warning("%s, abort query", error)
+            return False
+
+        meter.parser = self.parser_for(meter, Identification_Message)
+        if meter.parser is None:
+            return False
+        self.handle_identification(meter, Identification_Message)
+
+        Protocol_Mode, NewBaudrate, Baudrate_identification = protocol_mode(Identification_Message)
+        if Protocol_Mode == 'C' and self._fixed_baudrate:
+            # a raw ser2net port cannot follow a speed change, keep the meter at 300 baud
+            Baudrate_identification, NewBaudrate = INITIAL_BAUD_CHAR, INITIAL_BAUDRATE
+
+        # for protocol C or E we now send an acknowledge and include the new baudrate parameter
+        # maybe todo
+        # we could implement here a baudrate that is fixed to somewhat lower speed if we need to
+        # read out a smartmeter with broken communication
+        # Action = b'0'  # Data readout, possible are also b'1' for programming mode or some manufacturer specific
 
-            # for protocol C or E we now send an acknowledge and include the new baudrate parameter
-            # maybe todo
-            # we could implement here a baudrate that is fixed to somewhat lower speed if we need to
-            # read out a smartmeter with broken communication
-            # Action = b'0'  # Data readout, possible are also b'1' for programming mode or some manufacturer specific
+        try:
+            Acknowledge = acknowledge(Baudrate_identification)
+        except Exception as e:
+            _LOGGER.error("Konwersja Acknowledge: {0}".format(e))
+            return False
 
-            # Acknowledge = b'\x060' + Baudrate_identification.encode() + Action + b'\r\n'
+        registers = self.registers_for_cycle(meter, Protocol_Mode)
+        if registers is not None:
+            Acknowledge = acknowledge(Baudrate_identification, ACTION_PROGRAMMING)
 
+        if Protocol_Mode == 'C':
+            # the speed change in communication is initiated from the reading device,
+            # no sooner than the turnaround this meter accepts
+            self._sleep_until(received + meter.timing.turnaround)
+            _LOGGER.debug("Using protocol mode C, send acknowledge %s "
+                          "and tell smartmeter to switch to %s Baud", Acknowledge, NewBaudrate)
             try:
-                acko = '\x060' + Baudrate_identification + '0\r\n'
-                Acknowledge = bytearray(acko, 'ascii')
+                self._reader.mark()
+                sent = time.monotonic()
+                self._write(Acknowledge)
             except Exception as e:
-                _LOGGER.error("Konwersja Acknowledge: {0}".format(e))
-                time.sleep(10)
-                continue
-
-            if Protocol_Mode == 'C':
-                # the speed change in communication is initiated from the reading device
-                time.sleep(0.4)
-                _LOGGER.debug("Using protocol mode C, send acknowledge {} "
-                              "and tell smartmeter to switch to {} Baud".format(Acknowledge, NewBaudrate))
+                _LOGGER.warning("Warning %s", e)
+                self._connection_failed(e)
+                return False
+            # switch once the ACK is on the wire, the meter answers tr later
+            self._sleep_until(sent + transmit_time(len(Acknowledge), INITIAL_BAUDRATE) + MARGIN)
+            if NewBaudrate != INITIAL_BAUDRATE:
+                # change request to set higher baudrate
+                self._ser.baudrate = NewBaudrate
+                _LOGGER.debug("Nowa predkosc")
+        elif Protocol_Mode == 'B' and NewBaudrate != INITIAL_BAUDRATE:
+            # the meter switches right after the identification message
+            self._ser.baudrate = NewBaudrate
+
+        if registers is not None:
+            _LOGGER.debug("READ %s OBIS registers", len(registers))
+            message, status = self.read_registers(registers)
+        else:
+            message, status = self.read_data_message()
+        if Protocol_Mode == 'C':
+            # garbage or a NAK is not an answer, only a framed message shows the meter heard the ACK
+            meter.timing.acknowledge_done(message.started)
+        if self._reader.first_byte_at is not None:
+            self.metrics.observe("first_data", self._reader.first_byte_at - received)
+
+        self.handle_data_message(meter, message, status)
+        return status == FRAME_GOOD
+
+    def read_data_message(self):
+        """Read the data message of a full readout, return (DataMessage, status)."""
+        _LOGGER.debug("READ Full OBIS DATA")
+        starttime = time.time()
+        message = DataMessage()
+        status = FRAME_TRUNCATED
+        while True:
+            response = self.read_data_block_from_serial()
+
+            if response is None:
+                # the meter went silent for longer than the IEC inter-character timeout
+                _LOGGER.debug("No data received OBIS, data message ended without '!'")
+                break
+
+            # the lines are traced with the whole data message in handle_data_message
+            if (time.time() - starttime) > self.max_readout_time:
+                _LOGGER.debug("Przerwanie petli odczytu OBIS po %s s", self.max_readout_time)
+                break
+
+            message.add_line(response)
+            if is_end_of_data(response):
                 try:
-                    self._ser.write(Acknowledge)
-                except Exception as e:
-                    _LOGGER.warning("Warning {0}".format(e))
-                    time.sleep(10)
-                    continue
-                time.sleep(0.4)
-                if NewBaudrate != InitialBaudrate:
-                    # change request to set higher baudrate
-                    self._ser.baudrate = NewBaudrate
-                    _LOGGER.debug("Nowa predkosc")
-
-            _LOGGER.info("READ Full OBIS DATA")
-
-            licznik = 0
-            starttime = time.time()
-            petla = True
-            while petla:
-                response = None
-                response = self.read_data_block_from_serial()
-
-                if response is None:
-                    _LOGGER.debug("No data received OBIS ")
-                    time.sleep(10)
-                    licznik = licznik + 1
-                    if licznik > 3:
-                        petla = False
-                        break
-
-                    continue
-
-                runtime = time.time()
-                _LOGGER.debug("Time for reading OBIS data: {}".format(runtime))
-
-                if (runtime - starttime) > (3 * 60):
-                    _LOGGER.debug("Przerwanie petli odczytu OBIS o 3 minuty")
-                    petla = False
-                    break
-
-                _LOGGER.debug("OBIS data: Telegram: {} diff time: {}".format(response, (runtime - starttime)))
-                self.sensor_data, _ = parser.parse_data(self.sensor_data, response,
-                                                        reqs=Identification_Message.decode())
-                self._check_for_new_sensors_and_update(self.sensor_data)
-
-                time.sleep(0.2)
+                    trailer = self._reader.read(2)
+                except SerialException:
+                    trailer = None
+                status = message.verify(trailer)
+                break
+        return message, status
+
+    def read_registers(self, registers):
+        """Read registers one by one in programming mode, return (DataMessage, status)."""
+        operand = self.read_data_block_from_serial(end_byte=ETX)
+        status = verify_block(operand, self._read_bcc())
+        if status != FRAME_GOOD:
+            _LOGGER.debug("No programming mode operand message: %s", operand)
+            return DataMessage(), status
+        received = time.monotonic()
+        lines = []
+        for address in registers:
+            # tr applies to the reader as well
+            self._sleep_until(received + TR_MIN + MARGIN)
+            try:
+                self._write(read_command(address, self.read_command))
+            except SerialException as exc:
+                _LOGGER.warning("Error while write serial device %s: %s", self._ser, exc)
+                self._connection_failed(exc)
+                status = FRAME_TRUNCATED
+                break
+            block = self.read_data_block_from_serial(end_byte=ETX)
+            status = verify_block(block, self._read_bcc())
+            if self.trace.enabled:
+                self.trace.record(RX, block or b"", status)
+            if status != FRAME_GOOD:
+                break
+            received = time.monotonic()
+            line = register_line(address, block)
+            if line is None:
+                _LOGGER.debug("Meter has no register %s: %s", address, block)
+                continue
+            lines.append(line)
+        self._sleep_until(received + TR_MIN + MARGIN)
+        try:
+            self._write(BREAK)
+        except SerialException:
+            pass
+        return DataMessage(lines), status
 
-            time.sleep(40)
+    @staticmethod
+    def _sleep_until(deadline):
+        """Sleep until time.monotonic() reaches deadline."""
+        time.sleep(max(0.0, deadline - time.monotonic()))
 
-        _LOGGER.debug("Koniec pętli Pełnego odczytu danych")
+    def _write(self, data):
+        """Send data to the meter."""
+        if self.trace.enabled:
+            self.trace.record(TX, data)
+        self._ser.write(data)
 
-    def _find_parser(self, pkg):
-        """Helper to detect meter manufacturer."""
-        """
-        if _test_meter(pkg, AIDON_METER_SEQ):
-            _LOGGER.info("Detected Adion meter")
-            return "aidon"
-        elif _test_meter(pkg, KAIFA_METER_SEQ):
-            _LOGGER.info("Detected Kaifa meter")
-            return "kaifa"
-        elif _test_meter(pkg, KAMSTRUP_METER_SEQ):
-            _LOGGER.info("Detected Kamstrup meter")
-            return "kamstrup"
-        _LOGGER.warning("No parser detected")
-        """
-        pass
+    def _read_bcc(self):
+        """Read the block check character after an ETX."""
+        try:
+            return self._reader.read(1)
+        except SerialException:
+            return None
 
     @property
     def data(self):
         """Return sensor data."""
         return self.sensor_data
 
-    def missing_attrs(self, data=None):
-        """Check if we have any missing attrs that we need and set them."""
-
-        if data is None:
-            data = self.data
-
-        # return False
-
-        attrs_to_check = ["meter_serial", "meter_manufacturer", "meter_type"]
-        miss_attrs = [i for i in attrs_to_check if i not in self._attrs]
-        if miss_attrs:
-            cp_sensors_data = deepcopy(data)
-            for check in miss_attrs:
-                for value in cp_sensors_data.values():
-                    v = value.get("attributes", {}).get(check)
-                    if v:
-                        self._attrs[check] = v
-                        break
-            del cp_sensors_data
-            if len([i for i in attrs_to_check if i not in self._attrs]):
-                return True
-            else:
-                return False
-        else:
-            return False
-
-    def _check_for_new_sensors_and_update(self, sensor_data):
-        """Compare sensor list and update."""
+    @callback
+    def _check_for_new_sensors_and_update(self, meter, changed):
+        """Create sensors for new registers and signal the ones that changed."""
+        started = time.perf_counter()
         new_devices = []
-        sensors_in_data = set(sensor_data.keys())
-        new_devices = sensors_in_data.difference(LICZNIK_DEVICES)
+        sensors_in_data = set(self.sensor_data.keys())
+        new_devices = sensors_in_data.difference(self.devices)
 
         if len(new_devices):
             # Check that we have all the info we need before the sensors are
             # created, the most importent one is the meter_serial as this is
             # use to create the unique_id
-            if self.missing_attrs(sensor_data) is True:
+            if not meter.identity.complete:
                 _LOGGER.debug(
-                    "Missing some attributes waiting for new read from the serial"
+                    "Missing meter identity, waiting for new read from the serial"
                 )
             else:
                 _LOGGER.debug("Got %s new devices from the serial", len(new_devices))
                 # _LOGGER.debug("DUMP %s", sensor_data)
-                async_dispatcher_send(self._hass, SIGNAL_NEW_TELEGRAM_SENSOR)
-        else:
-            _LOGGER.debug("sensors are the same, updating states")
-            async_dispatcher_send(self._hass, SIGNAL_UPDATE_TELEGRAM)
+                async_dispatcher_send(self._hass, SIGNAL_NEW_TELEGRAM_SENSOR.format(self.hub_id))
 
-    def read_data_block_from_serial(self, end_byte=0x0a):
+        _LOGGER.debug("%s of %s registers changed", len(changed), len(meter.sensor_data))
+        for address in changed:
+            if address in self.devices:
+                async_dispatcher_send(
+                    self._hass, SIGNAL_UPDATE_TELEGRAM.format(self.hub_id, address)
+                )
+        self.metrics.observe("dispatch_time", time.perf_counter() - started)
+
+    def read_data_block_from_serial(self, end_byte=0x0a, timeout=RESPONSE_TIMEOUT):
         """
         This function reads some bytes from serial interface
-        it returns an array of bytes if a timeout occurs or a given end byte is encountered
-        and otherwise None if an error occurred
-        :param the_serial: interface to read from
+        it returns an array of bytes once the given end byte is encountered
+        and None if the IEC response/inter-character timeout expired or an error occurred
         :param end_byte: the indicator for end of data by source endpoint
+        :param timeout: seconds until the first byte has to arrive
         :returns the read data or None
         """
-        response = bytes()
-        krok = 0
-        kroka = 0
         try:
-            while True:
-                if self._ser.in_waiting:
-                    ch = self._ser.read()
-                else:
-                    if kroka < 50:
-                        # _LOGGER.debug("read_data_block_from_serial buffor pusty, czekam")
-                        kroka = kroka + 1
-                        time.sleep(0.02)
-                        continue
-                    else:
-                        _LOGGER.debug("read_data_block_from_serial kroka > 50 break")
-                        return None
-                        break
-                # _LOGGER.debug("read_data_block_from_serial Read {}".format(ch))
-                if len(ch) == 0:
-                    if krok < 50:
-                        krok = krok + 1
-                        time.sleep(0.02)
-                        continue
-                    else:
-                        _LOGGER.debug("read_data_block_from_serial Len = 0 break")
-                        return None
-                        break
-
-                response += ch
-                if ch == end_byte:
-                    # _LOGGER.debug("read_data_block_from_serial ch == end_byte break")
-                    break
-                if (response[-1] == end_byte):
-                    # _LOGGER.debug("read_data_block_from_serial response[-1] == end_byte break")
-                    break
-
-                time.sleep(0.01)
+            return self._reader.read_line(end_byte, timeout)
         except Exception as e:
-            _LOGGER.debug("read_data_block_from_serial Warning {0}".format(e))
+            _LOGGER.debug("read_data_block_from_serial Warning %s", e)
+            if self.trace.enabled:
+                self.trace.record(EVENT, note=e)
+            # a dead file descriptor raises a plain OSError from in_waiting
+            if isinstance(e, (SerialException, OSError)):
+                self._connection_failed(e)
             return None
 
-        return response
-
     def format_time(self, timedelta):
         """
         returns a pretty formatted string according to the size of the timedelta
@@ -477,3 +1034,4 @@ class LiHub:
             return "{:.2f} µs".format(timedelta * 1000000.0)
         elif timedelta > 0.000000001:
             return "{:.2f} ns".format(timedelta * 1000000000.0)
+        return "0 s"
@@ -0,0 +1,165 @@
+"""
+Terminal server stand-in.
+
+Shares a serial device over TCP like ser2net, either as a raw TCP port
+(serial_port: socket://host:port) or with RFC 2217 so the reader can switch
+baudrate and parity remotely (serial_port: rfc2217://host:port). One client
+is served at a time. With --emulate the device is a meter emulator on a PTY:
+
+    python -m custom_components.halicznik2.bridge --emulate norax30 --port 7000 --rfc2217
+
+Like the emulator it runs where Home Assistant is installed.
+"""
+import argparse
+import socket
+import sys
+import threading
+
+import serial
+import serial.rfc2217
+
+MODEM_LINES = ("cts", "dsr", "ri", "cd")
+CONTROL_LINES = ("rts", "dtr", "break_condition")
+
+
+class ModemLinesOff:
+    """Serial proxy for devices without modem and control lines, like a PTY."""
+
+    def __init__(self, ser):
+        """Wrap an open port."""
+        object.__setattr__(self, "_ser", ser)
+
+    def __getattr__(self, name):
+        """Delegate to the wrapped port."""
+        try:
+            return getattr(self._ser, name)
+        except OSError:
+            if name in MODEM_LINES:
+                return False
+            raise
+
+    def __setattr__(self, name, value):
+        """Delegate port settings to the wrapped port, control lines may be missing."""
+        try:
+            setattr(self._ser, name, value)
+        except OSError:
+            if name not in CONTROL_LINES:
+                raise
+
+
+class Bridge:
+    """Forward bytes between one TCP client and the serial device."""
+
+    def __init__(self, ser, client, rfc2217=False):
+        """Initialize the bridge for an accepted client."""
+        self._ser = ser
+        self._client = client
+        self._manager = None
+        if rfc2217:
+            # the manager polls the modem lines and applies the port settings the client asks for
+            self._manager = serial.rfc2217.PortManager(ModemLinesOff(ser), self)
+        self._running = True
+
+    def write(self, data):
+        """Send data to the client, PortManager answers telnet options through this."""
+        self._client.sendall(data)
+
+    def _serial_to_client(self):
+        """Copy what the device sends to the client."""
+        while self._running:
+            try:
+                data = self._ser.read(self._ser.in_waiting or 1)
+                if not data:
+                    continue
+                if self._manager is not None:
+                    data = b"".join(self._manager.escape(data))
+                self._client.sendall(data)
+            except (OSError, serial.SerialException):
+                break
+        self._running = False
+
+    def run(self):
+        """Forward until the client disconnects."""
+        thread = threading.Thread(target=self._serial_to_client, daemon=True)
+        thread.start()
+        try:
+            while self._running:
+                data = self._client.recv(1024)
+                if not data:
+                    break
+                if self._manager is not None:
+                    # telnet negotiation and port settings are handled here
+                    data = b"".join(self._manager.filter(data))
+                if data:
+                    self._ser.write(data)
+        except (OSError, serial.SerialException):
+            pass
+        finally:
+            self._running = False
+            thread.join()
+            self._client.close()
+
+
+def serve(device, host, port, rfc2217=False):
+    """Share the device with one client after the other until interrupted."""
+    ser = serial.serial_for_url(
+        device,
+        baudrate=300,
+        parity=serial.PARITY_EVEN,
+        stopbits=serial.STOPBITS_ONE,
+        bytesize=serial.SEVENBITS,
+        timeout=0.1,
+    )
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((host, port))
+    server.listen(1)
+    print(
+        "Sharing {} on {}://{}:{}".format(device, "rfc2217" if rfc2217 else "socket", host, port),
+        flush=True,
+    )
+    try:
+        while True:
+            client, address = server.accept()
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            print("Client {}:{} connected".format(*address), flush=True)
+            Bridge(ser, client, rfc2217).run()
+            print("Client {}:{} disconnected".format(*address), flush=True)
+    finally:
+        server.close()
+        ser.close()
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("device", nargs="?", help="serial device or pyserial URL to share")
+    parser.add_argument("--emulate", metavar="PROFILE", help="share a meter emulator instead of a device")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7000)
+    parser.add_argument("--rfc2217", action="store_true", help="speak RFC 2217 instead of raw TCP")
+    args = parser.parse_args(argv)
+
+    emulator = None
+    device = args.device
+    if args.emulate:
+        # imported here, sharing a real device must not depend on the emulator
+        from .emulator import PROFILES, MeterEmulator
+
+        emulator = MeterEmulator(*PROFILES[args.emulate])
+        emulator.start()
+        device = emulator.port
+    if device is None:
+        parser.error("give a device or --emulate")
+    try:
+        serve(device, args.host, args.port, args.rfc2217)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if emulator is not None:
+            emulator.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,303 @@
+"""
+Record and replay raw serial sessions.
+
+A capture file starts with MAGIC followed by one record per chunk of bytes:
+timestamp (float64), direction (1 byte), length (uint16) and the payload.
+
+Captures are replayed with the replay:// pyserial URL handler
+(serial_port: replay:///path/to/file.d0cap?speed=10) or on a PTY:
+
+    python -m custom_components.halicznik2.capture replay file.d0cap --speed 10
+
+The command needs Home Assistant installed, the package imports it.
+"""
+import argparse
+import os
+import select
+import struct
+import sys
+import time
+from collections import deque
+
+import serial
+
+from .iec62056 import ACK
+
+MAGIC = b"D0CAP1\n"
+RECORD = struct.Struct("<dcH")
+MAX_CHUNK = 0xFFFF
+
+# directions
+SIGN_ON = b"S"
+ACKNOWLEDGE = b"A"
+WRITE = b"W"
+READ = b"R"
+TX_DIRECTIONS = (SIGN_ON, ACKNOWLEDGE, WRITE)
+
+
+def register_url_handlers():
+    """Make the replay:// URL known to serial.serial_for_url."""
+    package = __package__ + ".urlhandler"
+    if package not in serial.protocol_handler_packages:
+        serial.protocol_handler_packages.append(package)
+
+
+def tx_direction(data):
+    """Classify bytes written to the meter."""
+    if data[:1] == b"/":
+        return SIGN_ON
+    if data[:1] == bytes((ACK,)):
+        return ACKNOWLEDGE
+    return WRITE
+
+
+class CaptureWriter:
+    """Append timestamped chunks of a serial session to a capture file."""
+
+    def __init__(self, path):
+        """Open the capture file for appending."""
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "ab")
+        if new:
+            self._file.write(MAGIC)
+
+    def record(self, direction, data):
+        """Write one chunk."""
+        now = time.time()
+        for start in range(0, len(data), MAX_CHUNK):
+            chunk = data[start:start + MAX_CHUNK]
+            self._file.write(RECORD.pack(now, direction, len(chunk)))
+            self._file.write(chunk)
+        self._file.flush()
+
+    def record_tx(self, data):
+        """Write bytes sent to the meter."""
+        self.record(tx_direction(data), data)
+
+    def record_rx(self, data):
+        """Write bytes received from the meter."""
+        self.record(READ, data)
+
+    def close(self):
+        """Close the capture file."""
+        self._file.close()
+
+
+def read_capture(path):
+    """Yield (timestamp, direction, data) records of a capture file."""
+    with open(path, "rb") as capture:
+        if capture.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not a capture file".format(path))
+        while True:
+            header = capture.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            timestamp, direction, length = RECORD.unpack(header)
+            yield timestamp, direction, capture.read(length)
+
+
+class RecordingSerial:
+    """serial.Serial wrapper that records everything read and written."""
+
+    def __init__(self, ser, capture):
+        """Wrap an open port."""
+        object.__setattr__(self, "_ser", ser)
+        object.__setattr__(self, "_capture", capture)
+
+    def __getattr__(self, name):
+        """Delegate to the wrapped port."""
+        return getattr(self._ser, name)
+
+    def __setattr__(self, name, value):
+        """Delegate settings like baudrate to the wrapped port."""
+        setattr(self._ser, name, value)
+
+    def read(self, size=1):
+        """Read from the port and record the bytes."""
+        data = self._ser.read(size)
+        if data:
+            self._capture.record_rx(data)
+        return data
+
+    def write(self, data):
+        """Record the bytes and write them to the port."""
+        self._capture.record_tx(data)
+        return self._ser.write(data)
+
+    def close(self):
+        """Close the port, the capture file outlives reconnects."""
+        self._ser.close()
+
+
+class Replayer:
+    """
+    Meter side of a capture.
+
+    Every write of the reader is matched with the next recorded write of the
+    same kind, the bytes the meter answered with are then due at their
+    recorded offsets, divided by speed. Bytes recorded before the first write
+    (push meters) are due from the start.
+    """
+
+    def __init__(self, records, speed=1.0, loop=False, now=0.0):
+        """Initialize from a list of capture records."""
+        self._records = records
+        self._speed = speed
+        self._loop = loop
+        self._pending = deque()
+        self._pos = 0
+        self._has_tx = any(record[1] in TX_DIRECTIONS for record in records)
+        self._schedule(0, records[0][0] if records else 0.0, now)
+
+    def _schedule(self, pos, origin, now):
+        """Queue the read records from pos up to the next write."""
+        records = self._records
+        while pos < len(records) and records[pos][1] == READ:
+            timestamp, _, data = records[pos]
+            self._pending.append((now + (timestamp - origin) / self._speed, data))
+            pos += 1
+        self._pos = pos
+
+    def _find(self, direction, start):
+        """Return the index of the next write of that kind, or of any write."""
+        records = self._records
+        fallback = None
+        for index in range(start, len(records)):
+            if records[index][1] == direction:
+                return index
+            if fallback is None and records[index][1] in TX_DIRECTIONS:
+                fallback = index
+        return fallback
+
+    def written(self, data, now):
+        """The reader sent data: drop what was not delivered and queue the answer."""
+        self._pending.clear()
+        direction = tx_direction(data)
+        index = self._find(direction, self._pos)
+        if index is None and self._loop:
+            index = self._find(direction, 0)
+        if index is None:
+            return
+        self._schedule(index + 1, self._records[index][0], now)
+
+    def due(self, now):
+        """Return the bytes due by now."""
+        if not self._pending and self._loop and not self._has_tx and self._records:
+            self._schedule(0, self._records[0][0], now)
+        data = bytearray()
+        while self._pending and self._pending[0][0] <= now:
+            data += self._pending.popleft()[1]
+        return bytes(data)
+
+    def next_due(self):
+        """Return when the next bytes are due, or None."""
+        return self._pending[0][0] if self._pending else None
+
+
+def replay_pty(path, speed=1.0, loop=False):
+    """Serve a capture on a PTY until interrupted."""
+    master, slave = os.openpty()
+    print("Replaying {} on {}".format(path, os.ttyname(slave)), flush=True)
+    replayer = Replayer(list(read_capture(path)), speed, loop, time.monotonic())
+    while True:
+        data = replayer.due(time.monotonic())
+        if data:
+            os.write(master, data)
+        next_due = replayer.next_due()
+        timeout = None if next_due is None else max(0.0, next_due - time.monotonic())
+        readable, _, _ = select.select([master], [], [], timeout)
+        if readable:
+            replayer.written(os.read(master, 4096), time.monotonic())
+
+
+def telegrams(path):
+    """Yield (identification, data message bytes) for every readout in a capture."""
+    sessions = []
+    for _, direction, data in read_capture(path):
+        if direction == SIGN_ON or not sessions:
+            sessions.append(bytearray())
+        if direction == READ:
+            sessions[-1] += data
+    for received in sessions:
+        identification, _, message = bytes(received).partition(b"\n")
+        if message:
+            yield identification + b"\n", message
+
+
+def bench(path, rounds=100):
+    """Time BCC verification and parsing of every readout in a capture."""
+    # imported here, replaying must not depend on the parsers
+    from .iec62056 import DataMessage, FRAME_GOOD, FrameBuffer, is_end_of_data
+    from .parsers import detect_parser, load_parser
+    from .readings import MeterIdentity
+
+    for identification, received in telegrams(path):
+        reqs = identification.decode("ascii", "replace")
+        parser = load_parser(detect_parser(reqs))
+        if parser is None:
+            print("{!r}: no parser".format(reqs.strip()))
+            continue
+        started = time.perf_counter()
+        for _ in range(rounds):
+            buffer = FrameBuffer()
+            buffer.feed(received)
+            message = DataMessage()
+            status = None
+            while True:
+                line = buffer.pop_line()
+                if line is None:
+                    break
+                message.add_line(line)
+                if is_end_of_data(line):
+                    status = message.verify(buffer.pop(2))
+                    break
+            if status != FRAME_GOOD:
+                break
+            identity = MeterIdentity()
+            parser.parse_identification(identity, reqs)
+            parser.parse_telegram({}, message.lines, identity)
+        elapsed = (time.perf_counter() - started) / rounds
+        print(
+            "{!r}: {} bytes, {} data sets, {}, {:.1f} us per telegram".format(
+                reqs.strip(), len(received), len(message.lines), status, elapsed * 1e6
+            )
+        )
+
+
+def dump(path):
+    """Print the records of a capture."""
+    start = None
+    for timestamp, direction, data in read_capture(path):
+        start = timestamp if start is None else start
+        print("{:10.3f} {} {!r}".format(timestamp - start, direction.decode(), data))
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("dump", help="print the records of a capture")
+    command.add_argument("path")
+    command = commands.add_parser("replay", help="replay a capture on a PTY")
+    command.add_argument("path")
+    command.add_argument("--speed", type=float, default=1.0)
+    command.add_argument("--loop", action="store_true")
+    command = commands.add_parser("bench", help="time verification and parsing of the readouts")
+    command.add_argument("path")
+    command.add_argument("--rounds", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    if args.command == "dump":
+        dump(args.path)
+    elif args.command == "replay":
+        try:
+            replay_pty(args.path, args.speed, args.loop)
+        except KeyboardInterrupt:
+            pass
+    else:
+        bench(args.path, args.rounds)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
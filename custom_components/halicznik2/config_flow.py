@@ -1,6 +1,6 @@
 """Adds config flow for hass-AMS."""
 import logging
-import os
+import urllib.parse as urlparse
 
 import serial.tools.list_ports as devices
 import voluptuous as vol
@@ -13,11 +13,16 @@ from .const import (
     DEFAULT_METER_MANUFACTURER,
     #DEFAULT_PARITY,
     DOMAIN,
-    MANUFACTURER_OPTIONS,
 )
+from .network import NETWORK_SCHEMES
+from .parsers import manufacturer_options
+from .supervisor import get_serial_by_id
 
 _LOGGER = logging.getLogger(__name__)
 
+# picked from the port list to enter a socket:// or rfc2217:// URL instead
+NETWORK_PORT = "Network port (socket:// or rfc2217://)"
+
 
 class AmsFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
     """Config flow for AMS."""
@@ -28,23 +33,28 @@ class AmsFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
     def __init__(self):
         """Initialize."""
         self._errors = {}
+        self._meter_manufacturer = DEFAULT_METER_MANUFACTURER
 
     async def async_step_user(self, user_input=None):
         """Handle a flow initialized by the user."""
-        if self._async_current_entries():
-            return self.async_abort(reason="single_instance_allowed")
-
         portdata = await self.hass.async_add_executor_job(devices.comports)
         ports = [(comport.device + ": " + comport.description) for comport in portdata]
+        ports.append(NETWORK_PORT)
 
         if user_input is not None:
             user_selection = user_input[CONF_SERIAL_PORT]
+            if user_selection == NETWORK_PORT:
+                self._meter_manufacturer = user_input[CONF_METER_MANUFACTURER]
+                return await self.async_step_network()
             port = portdata[ports.index(user_selection)]
             serial_by_id = await self.hass.async_add_executor_job(
                 get_serial_by_id, port.device
             )
             user_input[CONF_SERIAL_PORT] = serial_by_id
-            return self.async_create_entry(title="Norwegian AMS", data=user_input)
+            # one entry per port, every port gets its own hub
+            await self._async_set_port(serial_by_id)
+            self._abort_if_unique_id_configured()
+            return self.async_create_entry(title=serial_by_id, data=user_input)
         _LOGGER.debug(ports)
         return self.async_show_form(
             step_id="user",
@@ -53,33 +63,53 @@ class AmsFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
                     vol.Required(CONF_SERIAL_PORT, default=None): vol.In(ports),
                     vol.Required(
                         CONF_METER_MANUFACTURER, default=DEFAULT_METER_MANUFACTURER
-                    ): vol.In(MANUFACTURER_OPTIONS),
+                    ): vol.In(manufacturer_options()),
                     #vol.Optional(CONF_PARITY, default=DEFAULT_PARITY): vol.All(str),
                 }
             ),
             description_placeholders={
                 CONF_SERIAL_PORT: ports,
-                CONF_METER_MANUFACTURER: MANUFACTURER_OPTIONS,
+                CONF_METER_MANUFACTURER: manufacturer_options(),
             },
             errors=self._errors,
         )
 
+    async def async_step_network(self, user_input=None):
+        """Handle a meter behind a terminal server."""
+        errors = {}
+        if user_input is not None:
+            url = user_input[CONF_SERIAL_PORT].strip()
+            parts = urlparse.urlsplit(url)
+            if parts.scheme not in NETWORK_SCHEMES or not parts.hostname or not parts.port:
+                errors[CONF_SERIAL_PORT] = "invalid_url"
+            else:
+                await self._async_set_port(url)
+                self._abort_if_unique_id_configured()
+                return self.async_create_entry(
+                    title=url,
+                    data={
+                        CONF_SERIAL_PORT: url,
+                        CONF_METER_MANUFACTURER: self._meter_manufacturer,
+                    },
+                )
+        return self.async_show_form(
+            step_id="network",
+            data_schema=vol.Schema({vol.Required(CONF_SERIAL_PORT): str}),
+            errors=errors,
+        )
+
     async def async_step_import(self, import_config):
         """Import a config flow from configuration."""
-        if self._async_current_entries():
-            _LOGGER.warning("Only one configuration of hass-AMS is allowed.")
-            return self.async_abort(reason="singel_instance_allowed")
+        await self._async_set_port(import_config[CONF_SERIAL_PORT])
+        # configuration.yaml stays the source of the options, changes reach the entry on every start
+        self._abort_if_unique_id_configured(updates=import_config)
 
         return self.async_create_entry(title="configuration.yaml", data=import_config)
 
-
-def get_serial_by_id(dev_path):
-    """Return a /dev/serial/by-id match for given device if available."""
-    by_id = "/dev/serial/by-id"
-    if not os.path.isdir(by_id):
-        return dev_path
-
-    for path in (entry.path for entry in os.scandir(by_id) if entry.is_symlink()):
-        if os.path.realpath(path) == dev_path:
-            return path
-    return dev_path
+    async def _async_set_port(self, port):
+        """Use the port as unique id of the entry."""
+        for entry in self._async_current_entries():
+            if entry.unique_id is None and entry.data.get(CONF_SERIAL_PORT) == port:
+                # entries created before several ports were supported have no unique id
+                self.hass.config_entries.async_update_entry(entry, unique_id=port)
+        await self.async_set_unique_id(port)
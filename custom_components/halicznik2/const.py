@@ -1,14 +1,24 @@
 """ Constants for hass-AMS package"""
 
-import serial
-
 TELEGRAM_NEW_SENSORS = "ams_new_sensors"
 TELEGRAM_SENSORS = "ams_sensors"
-# Devices that we have read from the serial connection.
-LICZNIK_DEVICES = set()
-LICZNIK_SENSOR_CREATED_BUT_NOT_READ = set()
 
+CONF_ASYNC_ENGINE = "async_engine"
 CONF_BAUDRATE = "baudrate"
+CONF_BUFFER_RETENTION = "buffer_retention"
+CONF_CAPTURE_FILE = "capture_file"
+CONF_DETECTED_PARSERS = "detected_parsers"
+CONF_DEVICE_ADDRESSES = "device_addresses"
+CONF_FULL_READOUT_EVERY = "full_readout_every"
+CONF_JITTER = "jitter"
+CONF_MAX_READOUT_TIME = "max_readout_time"
+CONF_PUSH_BAUDRATE = "push_baudrate"
+CONF_PUSH_MODE = "push_mode"
+CONF_READ_COMMAND = "read_command"
+CONF_REGISTERS = "registers"
+CONF_ROLLING_WINDOW = "rolling_window"
+CONF_SCAN_INTERVAL = "scan_interval"
+CONF_TRACE_SIZE = "trace_size"
 CONF_METER_MANUFACTURER = "meter_manufacturer"
 CONF_SERIAL_PORT = "serial_port"
 
@@ -16,14 +26,45 @@ DOMAIN = "halicznik2"
 
 DEFAULT_SERIAL_PORT = "/dev/ttyUSB0"
 DEFAULT_BAUDRATE = 300
+# days buffered readings are kept on disk, 0 turns the buffer off
+DEFAULT_BUFFER_RETENTION = 7
+DEFAULT_ASYNC_ENGINE = True
 DEFAULT_METER_MANUFACTURER = "auto"
 DEFAULT_TIMEOUT = 0.4
+# seconds between the starts of two readout cycles
+DEFAULT_SCAN_INTERVAL = 40
+# upper bound of the per-hub phase offset of the sign-on, in seconds
+DEFAULT_JITTER = 0
+DEFAULT_MAX_READOUT_TIME = 3 * 60
+# seconds an unloading entry waits for the asyncio engine to let go of the port
+STOP_TIMEOUT = 5
+# protocol events kept in memory for the trace dump, 0 turns tracing off
+DEFAULT_TRACE_SIZE = 200
+# with registers configured, every n-th cycle is still a full data readout
+DEFAULT_FULL_READOUT_EVERY = 10
+DEFAULT_READ_COMMAND = "R1"
+# telegrams covered by the rolling power minimum, maximum and mean
+DEFAULT_ROLLING_WINDOW = 15
+# meters pushing in protocol mode D send at a fixed 2400 baud
+DEFAULT_PUSH_BAUDRATE = 2400
+DEFAULT_PUSH_MODE = False
+
+PUSH_BAUDRATE_OPTIONS = [300, 600, 1200, 2400, 4800, 9600, 19200]
+
+READ_COMMAND_OPTIONS = ["R1", "R5"]
 
 FRAME_FLAG = b"\x7e"
-MANUFACTURER_OPTIONS = ["auto", "ec3"]
+
+SERVICE_DUMP_TRACE = "dump_trace"
 
 PROTOKOL_OPTIONS = ["auto", "EC1", "PAF"]
 
-SIGNAL_UPDATE_TELEGRAM = "telegram_update"
-SIGNAL_NEW_TELEGRAM_SENSOR = "telegram_new_sensor"
+# formatted with the hub id and the address of the register that changed
+SIGNAL_UPDATE_TELEGRAM = "telegram_update_{}_{}"
+# formatted with the hub id
+SIGNAL_NEW_TELEGRAM_SENSOR = "telegram_new_sensor_{}"
+# formatted with the hub id, sent after every readout cycle
+SIGNAL_METRICS_UPDATE = "telegram_metrics_{}"
+# formatted with the hub id, sent when the port opens, fails or is being reopened
+SIGNAL_CONNECTION_UPDATE = "telegram_connection_{}"
 
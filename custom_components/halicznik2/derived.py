@@ -0,0 +1,202 @@
+"""
+Derived metrics.
+
+Values that would otherwise need template sensors are computed in the hub,
+in constant time per telegram:
+
+    power                  average power from the energy delta since the last telegram
+    power_min/max/mean     rolling window over the last power values
+    apparent_power_l1..l3  voltage times current of one phase
+    apparent_power         sum of the phases
+
+Derived readings are stored next to the registers of the meter, so they get
+sensors, dispatches and the reading buffer like any register.
+"""
+from collections import deque
+from datetime import datetime
+
+from .obis import ObisInfo, parse_obis
+from .readings import Reading
+
+# cumulative energy registers, the first one the meter sends is used
+ENERGY_CHANNELS = ((15, 8, 0), (1, 8, 0))
+# phase, current and voltage registers
+PHASE_CHANNELS = (
+    ("l1", (31, 7, 0), (32, 7, 0)),
+    ("l2", (51, 7, 0), (52, 7, 0)),
+    ("l3", (71, 7, 0), (72, 7, 0)),
+)
+TIME_CHANNEL = (0, 9, 1)
+DATE_CHANNEL = (0, 9, 2)
+# meter clock registers, hhmmss and YYMMDD
+METER_TIME_FORMAT = "%y%m%d%H%M%S"
+
+# watts per energy unit and hour
+WATTS = {"kWh": 1000.0, "Wh": 1.0, "MWh": 1000000.0}
+
+POWER = "power"
+POWER_INFO = ObisInfo("Moc czynna średnia", "W", True, "measurement", "power")
+WINDOW_INFO = {
+    "power_min": ObisInfo("Moc czynna minimalna", "W", True, "measurement", "power"),
+    "power_max": ObisInfo("Moc czynna maksymalna", "W", True, "measurement", "power"),
+    "power_mean": ObisInfo("Moc czynna, średnia krocząca", "W", True, "measurement", "power"),
+}
+APPARENT_POWER = "apparent_power"
+APPARENT_POWER_INFO = ObisInfo("Moc pozorna", "VA", True, "measurement", "apparent_power")
+PHASE_INFO = {
+    phase: APPARENT_POWER_INFO._replace(description="Moc pozorna, faza {}".format(phase.upper()))
+    for phase, _, _ in PHASE_CHANNELS
+}
+
+
+class RollingWindow:
+    """Minimum, maximum and mean of the last size values, O(1) amortized per value."""
+
+    def __init__(self, size):
+        """Initialize an empty window."""
+        self._values = deque(maxlen=size)
+        self._total = 0.0
+        # candidates for the minimum and maximum in window order
+        self._min = deque()
+        self._max = deque()
+
+    def add(self, value):
+        """Add a value, dropping the oldest one from a full window."""
+        values = self._values
+        if len(values) == values.maxlen:
+            oldest = values[0]
+            self._total -= oldest
+            if self._min[0] == oldest:
+                self._min.popleft()
+            if self._max[0] == oldest:
+                self._max.popleft()
+        values.append(value)
+        self._total += value
+        while self._min and self._min[-1] > value:
+            self._min.pop()
+        self._min.append(value)
+        while self._max and self._max[-1] < value:
+            self._max.pop()
+        self._max.append(value)
+
+    @property
+    def minimum(self):
+        """Return the smallest value in the window."""
+        return self._min[0]
+
+    @property
+    def maximum(self):
+        """Return the largest value in the window."""
+        return self._max[0]
+
+    @property
+    def mean(self):
+        """Return the mean of the window."""
+        return self._total / len(self._values)
+
+
+class DerivedMetrics:
+    """Derive power values of one meter from its registers."""
+
+    def __init__(self, identity, window):
+        """Initialize the stage, window is the number of power values the rolling metrics cover."""
+        self._identity = identity
+        self._window = RollingWindow(window)
+        # channel -> register address, filled as registers show up
+        self._addresses = {}
+        self._indexed = 0
+        self._last_energy = None
+        self._last_time = None
+        self._meter_clock = False
+
+    def _index(self, stored):
+        """Map the channels of registers that are new since the last telegram."""
+        if len(stored) == self._indexed:
+            return
+        # registers are only ever added, the new ones are at the end
+        for address in list(stored)[self._indexed:]:
+            code = parse_obis(address)
+            if code is not None:
+                self._addresses.setdefault((code.c, code.d, code.e), address)
+        self._indexed = len(stored)
+
+    def _reading(self, stored, channel):
+        """Return the reading of a channel, or None if the meter does not send it."""
+        address = self._addresses.get(channel)
+        return stored.get(address) if address is not None else None
+
+    def _set(self, stored, name, info, value, captured, changed):
+        """Store a derived value and note its name if it changed."""
+        reading = stored.get(name)
+        if reading is None:
+            reading = stored[name] = Reading(name, info, self._identity)
+        if reading.update(round(value, 1), info.unit, "", captured):
+            changed.append(name)
+
+    def _meter_time(self, stored, captured):
+        """Return the meter clock of this telegram, or None if the meter has none."""
+        clock = self._reading(stored, TIME_CHANNEL)
+        date = self._reading(stored, DATE_CHANNEL)
+        if clock is None or date is None or clock.captured != captured or date.captured != captured:
+            return None
+        try:
+            return datetime.strptime(str(date.value) + str(clock.value), METER_TIME_FORMAT)
+        except ValueError:
+            return None
+
+    def update(self, stored):
+        """Derive new values from the stored registers, return the derived names that changed."""
+        self._index(stored)
+        changed = []
+        energy = None
+        for channel in ENERGY_CHANNELS:
+            energy = self._reading(stored, channel)
+            if energy is not None:
+                break
+        if energy is not None and isinstance(energy.value, float) and energy.unit in WATTS:
+            self._power(stored, energy, changed)
+
+        total = 0.0
+        phases = 0
+        captured = None
+        for phase, current_channel, voltage_channel in PHASE_CHANNELS:
+            current = self._reading(stored, current_channel)
+            voltage = self._reading(stored, voltage_channel)
+            if current is None or voltage is None:
+                continue
+            if not isinstance(current.value, float) or not isinstance(voltage.value, float):
+                continue
+            apparent = current.value * voltage.value
+            total += apparent
+            phases += 1
+            captured = current.captured
+            name = "{}_{}".format(APPARENT_POWER, phase)
+            self._set(stored, name, PHASE_INFO[phase], apparent, captured, changed)
+        if phases > 1:
+            self._set(stored, APPARENT_POWER, APPARENT_POWER_INFO, total, captured, changed)
+        return changed
+
+    def _power(self, stored, energy, changed):
+        """Turn the energy delta since the last telegram into average power."""
+        captured = energy.captured
+        # the meter clock is free of the jitter of the readout, use it when the meter sends one
+        now = self._meter_time(stored, captured)
+        meter_clock = now is not None
+        if not meter_clock:
+            now = captured
+        last_energy, last_time = self._last_energy, self._last_time
+        if meter_clock != self._meter_clock:
+            # never take a delta across the meter clock and the local clock
+            last_time = None
+        self._last_energy, self._last_time, self._meter_clock = energy.value, now, meter_clock
+        if last_time is None or now <= last_time or energy.value < last_energy:
+            # first telegram, the same telegram again or a meter reset
+            return
+        seconds = (now - last_time).total_seconds()
+        power = (energy.value - last_energy) * WATTS[energy.unit] * 3600 / seconds
+        self._set(stored, POWER, POWER_INFO, power, captured, changed)
+        window = self._window
+        window.add(power)
+        self._set(stored, "power_min", WINDOW_INFO["power_min"], window.minimum, captured, changed)
+        self._set(stored, "power_max", WINDOW_INFO["power_max"], window.maximum, captured, changed)
+        self._set(stored, "power_mean", WINDOW_INFO["power_mean"], window.mean, captured, changed)
@@ -0,0 +1,34 @@
+"""Diagnostics download of a hub: readout metrics, frame counters, meter timing and the protocol trace."""
+from .const import DOMAIN
+
+
+async def async_get_config_entry_diagnostics(hass, entry):
+    """Return the diagnostics of the hub behind a config entry."""
+    hub = hass.data[DOMAIN][entry.entry_id]
+    return {
+        "config": dict(entry.data),
+        "frame_counters": dict(hub.frame_counters),
+        "connection": {
+            "state": hub.supervisor.state,
+            "port": hub.supervisor.path,
+            "reconnects": hub.supervisor.reconnects,
+            "failures": hub.supervisor.failures,
+            "last_error": hub.supervisor.last_error,
+        },
+        "meters": [
+            {
+                "address": meter.address,
+                "manufacturer": meter.identity.manufacturer,
+                "type": meter.identity.type,
+                "serial": meter.identity.serial,
+                "parser": meter.parser.__name__ if meter.parser is not None else None,
+                "cycles": meter.cycles,
+                "turnaround": meter.timing.turnaround,
+                "response_time": meter.timing.response_time,
+                "registers": len(meter.sensor_data),
+            }
+            for meter in hub.meters
+        ],
+        "metrics": hub.metrics.as_dict(),
+        "trace": hub.trace.dump(),
+    }
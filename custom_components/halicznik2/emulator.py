@@ -0,0 +1,371 @@
+"""
+IEC 62056-21 meter emulator on a PTY.
+
+Answers the sign-on with a configurable identification, handles the
+protocol mode A/B/C baudrate switch and streams a data message with a
+correct BCC. An ACK with action '1' enters programming mode, where R1/R5
+read commands are answered register by register until B0. Several meters
+with their own device address can share one PTY like an RS-485 bus:
+
+    python -m custom_components.halicznik2.emulator --address 1001 --meter 1002=ec3
+
+With --push the meter sends a frame every few seconds unasked, like a
+protocol mode D meter. Faults can be injected to exercise the reader:
+
+    python -m custom_components.halicznik2.emulator --profile norax30 --drop-rate 0.001
+
+Point serial_port at the printed PTY path. Importing the package loads
+Home Assistant, so run the tools from the environment Home Assistant is
+installed in; bridge and capture need the same.
+"""
+import argparse
+import os
+import random
+import select
+import sys
+import threading
+import time
+
+from .iec62056 import (
+    ACK,
+    ACTION_PROGRAMMING,
+    ETX,
+    FRAME_GOOD,
+    INITIAL_BAUDRATE,
+    NAK,
+    SOH,
+    STX,
+    baudrate_mode,
+    bcc,
+    command_message,
+    protocol_mode,
+    verify_block,
+)
+from .timing import BITS_PER_CHARACTER
+
+PROFILES = {
+    "ec3": (
+        "/PAF5EC3GR1234",
+        [
+            "0.0.0(12345678)",
+            "0.9.1(123456)",
+            "0.9.2(210101)",
+            "0.1.0(12)",
+            "15.8.0*00(001234.5 kWh)",
+        ],
+    ),
+    "norax30": (
+        # '\2' announces the enhanced capabilities, the model follows it
+        "/PAF5\\2NORAX3D",
+        [
+            "1-0:0.0.0(12345678)",
+            "1-0:15.8.0(001234.567*kWh)",
+            "1-0:31.7.0(001.23*A)",
+            "1-0:32.7.0(230.1*V)",
+            "1-0:51.7.0(000.98*A)",
+            "1-0:52.7.0(229.8*V)",
+            "1-0:71.7.0(002.05*A)",
+            "1-0:72.7.0(231.0*V)",
+        ],
+    ),
+}
+
+# the meter gives up waiting for the ACK and sends at the initial baudrate (tt)
+ACKNOWLEDGE_TIMEOUT = 2.2
+# the meter leaves programming mode when no command arrives in time
+INACTIVITY_TIMEOUT = 5.0
+
+
+def data_message(data_sets):
+    """Build STX data-block '!' CR LF ETX BCC from data set strings."""
+    body = "".join(line + "\r\n" for line in data_sets).encode("ascii")
+    body += b"!\r\n" + bytes((ETX,))
+    return bytes((STX,)) + body + bytes((bcc(body),))
+
+
+def answer_message(data):
+    """Build STX data ETX BCC, the answer to a programming mode command."""
+    body = data + bytes((ETX,))
+    return bytes((STX,)) + body + bytes((bcc(body),))
+
+
+class MeterEmulator:
+    """A meter on the master side of a PTY."""
+
+    def __init__(
+        self,
+        identification,
+        data_sets,
+        address="",
+        response_delay=0.2,
+        min_turnaround=0.0,
+        push_interval=None,
+        push_baudrate=2400,
+        realtime=True,
+        drop_rate=0.0,
+        parity_error_rate=0.0,
+        char_gap=0.0,
+        stall_rate=0.0,
+        stall_time=2.0,
+        seed=None,
+    ):
+        """Initialize the emulator."""
+        # device address -> (identification, data sets, registers), the first one answers broadcasts
+        self.meters = {}
+        self.add_meter(address, identification, data_sets)
+        self.identification, self.data_sets, self.registers = self.meters[address]
+        self.response_delay = response_delay
+        # an ACK arriving sooner after the identification is not heard
+        self.min_turnaround = min_turnaround
+        self.push_interval = push_interval
+        self.push_baudrate = push_baudrate
+        self.realtime = realtime
+        self.drop_rate = drop_rate
+        self.parity_error_rate = parity_error_rate
+        self.char_gap = char_gap
+        self.stall_rate = stall_rate
+        self.stall_time = stall_time
+        self.requests = 0
+        self.commands = 0
+        self._random = random.Random(seed)
+        self._baudrate = INITIAL_BAUDRATE
+        self._master, self._slave = os.openpty()
+        self.port = os.ttyname(self._slave)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_meter(self, address, identification, data_sets):
+        """Put another meter with its own device address on the bus."""
+        registers = {}
+        for data_set in data_sets:
+            register, _, value = data_set.partition("(")
+            registers[register] = "(" + value
+            # answer read commands without the A-B prefix as well
+            registers.setdefault(register.rpartition(":")[2], "(" + value)
+        self.meters[address] = (identification.encode("ascii") + b"\r\n", list(data_sets), registers)
+
+    def _select(self, request):
+        """Pick the meter addressed by a request message, None if no meter is addressed."""
+        address = request[request.index(b"/?") + 2:-3].decode("ascii", "replace")
+        if not address:
+            return next(iter(self.meters.values()))
+        return self.meters.get(address)
+
+    def __enter__(self):
+        """Start serving in a thread."""
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        """Stop serving."""
+        self.stop()
+
+    def start(self):
+        """Serve requests in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving and close the PTY."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def _read(self, timeout):
+        """Return bytes written by the reader, b'' on timeout."""
+        readable, _, _ = select.select([self._master], [], [], timeout)
+        if not readable:
+            return b""
+        return os.read(self._master, 4096)
+
+    def _read_line(self, timeout):
+        """Return one CR LF terminated request, or None on timeout."""
+        deadline = time.monotonic() + timeout
+        line = b""
+        while not line.endswith(b"\r\n"):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop.is_set():
+                return None
+            line += self._read(min(remaining, 0.1))
+        return line
+
+    def _read_command(self, timeout):
+        """Return one SOH ... ETX BCC command, or None on timeout."""
+        deadline = time.monotonic() + timeout
+        block = b""
+        while ETX not in block[:-1]:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop.is_set():
+                return None
+            block += self._read(min(remaining, 0.1))
+        return block[:block.index(ETX) + 2]
+
+    def _corrupt(self, char):
+        """Apply the injected faults to one character, None drops it."""
+        if self.drop_rate and self._random.random() < self.drop_rate:
+            return None
+        if self.parity_error_rate and self._random.random() < self.parity_error_rate:
+            # a flipped data bit, the parity bit no longer matches
+            char ^= 1 << self._random.randrange(7)
+        return char
+
+    def _send(self, data):
+        """Transmit data at the current baudrate with the configured faults."""
+        character_time = BITS_PER_CHARACTER / self._baudrate if self.realtime else 0.0
+        if not (self.drop_rate or self.parity_error_rate or self.char_gap or self.stall_rate):
+            if not character_time:
+                os.write(self._master, data)
+                return
+            # pace the characters so the reader sees them at wire speed
+            start = time.monotonic()
+            for index in range(len(data)):
+                os.write(self._master, data[index:index + 1])
+                time.sleep(max(0.0, start + (index + 1) * character_time - time.monotonic()))
+            return
+        for char in data:
+            char = self._corrupt(char)
+            if char is not None:
+                os.write(self._master, bytes((char,)))
+            delay = character_time + self.char_gap
+            if self.stall_rate and self._random.random() < self.stall_rate:
+                delay += self.stall_time
+            if delay:
+                time.sleep(delay)
+
+    def serve_forever(self):
+        """Answer sign-on requests until stopped."""
+        if self.push_interval:
+            self._push_forever()
+            return
+        while not self._stop.is_set():
+            request = self._read_line(0.5)
+            if request is None or not request.endswith(b"!\r\n") or b"/?" not in request:
+                continue
+            meter = self._select(request)
+            if meter is None:
+                # another meter on the bus is addressed
+                continue
+            self.identification, self.data_sets, self.registers = meter
+            self.requests += 1
+            self._baudrate = INITIAL_BAUDRATE
+            time.sleep(self.response_delay)
+            self._send(self.identification)
+            self._after_identification()
+
+    def _push_forever(self):
+        """Send identification and data message every push_interval seconds."""
+        self._baudrate = self.push_baudrate
+        while not self._stop.wait(self.push_interval):
+            self.requests += 1
+            self._send(self.identification + data_message(self.data_sets))
+
+    def _after_identification(self):
+        """Switch baudrate as the protocol mode says and send the data message."""
+        mode, baudrate, _ = protocol_mode(self.identification)
+        if mode == 'B':
+            self._baudrate = baudrate
+        elif mode == 'C':
+            identified = time.monotonic()
+            ack = self._read_line(ACKNOWLEDGE_TIMEOUT)
+            if ack is not None and time.monotonic() - identified < self.min_turnaround:
+                # still busy, the ACK went unheard and the reader waits in vain
+                return
+            if ack is not None and ack[:1] == bytes((ACK,)) and len(ack) >= 6:
+                _, baudrate = baudrate_mode(chr(ack[2]))
+                self._baudrate = baudrate
+                if chr(ack[3]) == ACTION_PROGRAMMING:
+                    self._programming_mode()
+                    return
+        time.sleep(self.response_delay)
+        self._send(data_message(self.data_sets))
+
+    def _programming_mode(self):
+        """Send the P0 operand and answer read commands until B0."""
+        time.sleep(self.response_delay)
+        serial = self.registers.get("0.0.0", "()")
+        self._send(command_message(b"P0", serial.encode("ascii")))
+        while True:
+            command = self._read_command(INACTIVITY_TIMEOUT)
+            if command is None:
+                return
+            if command[:1] != bytes((SOH,)) or verify_block(command[:-1], command[-1:]) != FRAME_GOOD:
+                self._send(bytes((NAK,)))
+                continue
+            self.commands += 1
+            code = command[1:3]
+            if code == b"B0":
+                return
+            time.sleep(self.response_delay)
+            address = command[4:command.find(b"(")].decode("ascii", "replace")
+            value = self.registers.get(address) if code in (b"R1", b"R5") else None
+            if value is None:
+                self._send(answer_message(b"(ERROR)"))
+            else:
+                self._send(answer_message((address + value).encode("ascii")))
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="norax30")
+    parser.add_argument("--identification", help="identification without CR LF, e.g. /PAF5EC3GR1234")
+    parser.add_argument("--data-file", help="file with one data set per line")
+    parser.add_argument("--address", default="", help="device address of the meter")
+    parser.add_argument(
+        "--meter", action="append", default=[], metavar="ADDRESS=PROFILE",
+        help="another meter on the bus, may be repeated",
+    )
+    parser.add_argument("--response-delay", type=float, default=0.2)
+    parser.add_argument(
+        "--min-turnaround", type=float, default=0.0,
+        help="ignore an ACK sent sooner after the identification",
+    )
+    parser.add_argument("--push", type=float, metavar="SECONDS", help="push a frame every SECONDS")
+    parser.add_argument("--push-baudrate", type=int, default=2400)
+    parser.add_argument("--no-realtime", action="store_true", help="do not emulate the wire speed")
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--parity-error-rate", type=float, default=0.0)
+    parser.add_argument("--char-gap", type=float, default=0.0)
+    parser.add_argument("--stall-rate", type=float, default=0.0)
+    parser.add_argument("--stall-time", type=float, default=2.0)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    identification, data_sets = PROFILES[args.profile]
+    if args.identification:
+        identification = args.identification
+    if args.data_file:
+        with open(args.data_file) as data_file:
+            data_sets = [line.strip() for line in data_file if line.strip()]
+
+    emulator = MeterEmulator(
+        identification,
+        data_sets,
+        address=args.address,
+        response_delay=args.response_delay,
+        min_turnaround=args.min_turnaround,
+        push_interval=args.push,
+        push_baudrate=args.push_baudrate,
+        realtime=not args.no_realtime,
+        drop_rate=args.drop_rate,
+        parity_error_rate=args.parity_error_rate,
+        char_gap=args.char_gap,
+        stall_rate=args.stall_rate,
+        stall_time=args.stall_time,
+        seed=args.seed,
+    )
+    for meter in args.meter:
+        address, _, profile = meter.partition("=")
+        emulator.add_meter(address, *PROFILES[profile])
+    print("Emulating {} on {}".format(identification, emulator.port), flush=True)
+    try:
+        emulator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
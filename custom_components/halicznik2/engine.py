@@ -0,0 +1,537 @@
+"""
+Asyncio readout engine.
+
+Runs the IEC 62056-21 sign-on, ACK/baudrate switch and data readout on the
+Home Assistant event loop instead of a worker thread. Reads wake up when the
+serial transport delivers data. Meters sharing an RS-485 bus are polled one
+after the other with addressed sign-ons over the same open port. Meters that
+push in protocol mode D are only listened to.
+
+Ports given as pyserial URLs (rfc2217://, socket://, replay://) have no file
+descriptor the event loop could watch, a reader thread feeds the protocol
+instead. The port stays open across readout cycles. After an error it is
+reopened with the backoff of the hub's connection supervisor.
+"""
+import asyncio
+import functools
+import logging
+import threading
+
+import async_timeout
+import serial
+import serial_asyncio
+from serial import SerialException
+
+from .const import DEFAULT_TIMEOUT
+from .iec62056 import (
+    ACTION_PROGRAMMING,
+    BREAK,
+    ETX,
+    FRAME_GOOD,
+    FRAME_TRUNCATED,
+    INITIAL_BAUDRATE,
+    INITIAL_BAUD_CHAR,
+    INTER_CHARACTER_TIMEOUT,
+    LF,
+    RESPONSE_TIMEOUT,
+    DataMessage,
+    FrameBuffer,
+    PushDecoder,
+    acknowledge,
+    check_identification,
+    is_end_of_data,
+    protocol_mode,
+    read_command,
+    register_line,
+    sign_on,
+    verify_block,
+)
+from .network import PORT_ERRORS, has_fixed_baudrate, is_url, open_port
+from .timing import MARGIN, TR_MIN, response_timeout, transmit_time
+from .trace import EVENT, RX, TX
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class D0Protocol(asyncio.Protocol):
+    """Collect bytes from the serial transport and hand out lines."""
+
+    def __init__(self):
+        """Initialize the protocol."""
+        self.transport = None
+        self._buffer = FrameBuffer()
+        self._data_event = asyncio.Event()
+        self._closed = None
+        self.capture = None
+        # loop time the first byte arrived since the last reset_input() or mark()
+        self.first_byte_at = None
+        # bytes received since the port was opened
+        self.received = 0
+
+    def connection_made(self, transport):
+        """Store the transport."""
+        self.transport = transport
+
+    def data_received(self, data):
+        """Buffer incoming bytes and wake up the reader."""
+        if self.capture is not None:
+            self.capture.record_rx(data)
+        if self.first_byte_at is None:
+            self.first_byte_at = asyncio.get_running_loop().time()
+        self.received += len(data)
+        self._buffer.feed(data)
+        self._data_event.set()
+
+    def connection_lost(self, exc):
+        """Wake up the reader so it can notice the port is gone."""
+        self._closed = exc or SerialException("serial port closed")
+        self._data_event.set()
+
+    def reset_input(self):
+        """Drop anything left over from a previous exchange."""
+        self._buffer.clear()
+        self._data_event.clear()
+        self.first_byte_at = None
+
+    def mark(self):
+        """Start timing the answer to the next request."""
+        self.first_byte_at = None
+
+    async def _fill(self, deadline, inter_character_timeout):
+        """Wait for more bytes, return the new deadline or None on timeout."""
+        loop = asyncio.get_running_loop()
+        if self._closed is not None:
+            raise self._closed
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return None
+        self._data_event.clear()
+        try:
+            # wait_for can swallow a cancel that races with the event, stopping needs it
+            async with async_timeout.timeout(remaining):
+                await self._data_event.wait()
+        except asyncio.TimeoutError:
+            return None
+        return loop.time() + inter_character_timeout
+
+    async def read_line(self, end_byte=LF, timeout=RESPONSE_TIMEOUT,
+                        inter_character_timeout=INTER_CHARACTER_TIMEOUT):
+        """Return bytes up to and including end_byte, or None on timeout."""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while True:
+            line = self._buffer.pop_line(end_byte)
+            if line is not None:
+                return line
+            deadline = await self._fill(deadline, inter_character_timeout)
+            if deadline is None:
+                return None
+
+    async def read_chunk(self, timeout):
+        """Return all buffered bytes, b'' if nothing arrived within timeout."""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not len(self._buffer):
+            if await self._fill(deadline, 0) is None:
+                return b""
+        return self._buffer.pop(len(self._buffer))
+
+    async def read(self, size, timeout=RESPONSE_TIMEOUT,
+                   inter_character_timeout=INTER_CHARACTER_TIMEOUT):
+        """Return exactly size bytes, or None on timeout."""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while True:
+            data = self._buffer.pop(size)
+            if data is not None:
+                return data
+            deadline = await self._fill(deadline, inter_character_timeout)
+            if deadline is None:
+                return None
+
+
+class ThreadedPortTransport(asyncio.Transport):
+    """Transport over a blocking pyserial port, a thread reads and hands the bytes to the loop."""
+
+    def __init__(self, loop, protocol, ser):
+        """Start reading the open port."""
+        super().__init__()
+        self._loop = loop
+        self._protocol = protocol
+        self.serial = ser
+        self._closing = False
+        protocol.connection_made(self)
+        self._thread = threading.Thread(target=self._read_forever, daemon=True)
+        self._thread.start()
+
+    def _read_forever(self):
+        """Read until the transport is closed or the port fails."""
+        exc = None
+        try:
+            while not self._closing:
+                data = self.serial.read(self.serial.in_waiting or 1)
+                if data:
+                    self._loop.call_soon_threadsafe(self._protocol.data_received, data)
+        except PORT_ERRORS as err:
+            exc = err
+        finally:
+            # closing an rfc2217 port waits for its own thread, keep that off the loop
+            self.serial.close()
+        if not self._closing:
+            self._loop.call_soon_threadsafe(self._protocol.connection_lost, exc)
+
+    def write(self, data):
+        """Write data, a network port blocks at most until the socket buffer takes it."""
+        self.serial.write(data)
+
+    def is_closing(self):
+        """Return True once close() was called."""
+        return self._closing
+
+    def close(self):
+        """Stop the reader thread, it closes the port within one read timeout."""
+        self._closing = True
+
+
+class AsyncReadoutEngine:
+    """Drive the readout cycles of one hub on the event loop."""
+
+    def __init__(self, hub, port):
+        """Initialize the engine."""
+        self._hub = hub
+        self._port = port
+        self._transport = None
+        self._protocol = None
+        # the meter has to stay at the speed of a raw TCP port
+        self._fixed_baudrate = has_fixed_baudrate(port)
+
+    async def _connect(self, baudrate=INITIAL_BAUDRATE):
+        """Open the port, waiting out the backoff after failures until it opens or the hub stops."""
+        supervisor = self._hub.supervisor
+        while self._hub._running:
+            delay = supervisor.delay()
+            if delay:
+                await asyncio.sleep(delay)
+                if not self._hub._running:
+                    break
+            supervisor.connecting()
+            self._hub.connection_changed()
+            try:
+                await self._open(baudrate)
+            except PORT_ERRORS as exc:
+                _LOGGER.warning("Cannot open serial device %s: %s", self._port, exc)
+                supervisor.failed(exc)
+                self._hub.connection_changed()
+                continue
+            supervisor.connected()
+            self._hub.connection_changed()
+            return
+
+    def _connection_failed(self, exc):
+        """Close the port after an error, the next cycle reopens it."""
+        _LOGGER.warning("Error on serial device %s: %s", self._port, exc)
+        if self._hub.trace.enabled:
+            self._hub.trace.record(EVENT, note=exc)
+        self.close()
+        self._hub.supervisor.failed(exc)
+        self._hub.connection_changed()
+
+    async def _open(self, baudrate=INITIAL_BAUDRATE):
+        """Open the serial port as an asyncio transport."""
+        loop = asyncio.get_running_loop()
+        # an adapter that came back may have another device name
+        port = await loop.run_in_executor(None, self._hub.supervisor.resolve)
+        if is_url(port):
+            # connecting to a terminal server blocks
+            ser = await loop.run_in_executor(
+                None, functools.partial(open_port, port, baudrate, DEFAULT_TIMEOUT)
+            )
+            self._protocol = D0Protocol()
+            self._transport = ThreadedPortTransport(loop, self._protocol, ser)
+            self._protocol.capture = self._hub.capture
+            _LOGGER.debug("Connected to %s", port)
+            return
+        self._transport, self._protocol = await serial_asyncio.create_serial_connection(
+            loop,
+            D0Protocol,
+            port,
+            baudrate=baudrate,
+            parity=serial.PARITY_EVEN,
+            stopbits=serial.STOPBITS_ONE,
+            bytesize=serial.SEVENBITS,
+            timeout=DEFAULT_TIMEOUT,
+        )
+        self._protocol.capture = self._hub.capture
+
+    def _write(self, data):
+        """Send data to the meter."""
+        if self._hub.capture is not None:
+            self._hub.capture.record_tx(data)
+        if self._hub.trace.enabled:
+            self._hub.trace.record(TX, data)
+        self._transport.write(data)
+
+    async def _set_baudrate(self, baudrate):
+        """Switch the baudrate of the underlying serial port."""
+        ser = self._transport.serial
+        if ser is None:
+            # serial_asyncio drops the port once it failed, e.g. an unplugged adapter
+            raise SerialException("serial port closed")
+        if ser.baudrate == baudrate:
+            return
+        if isinstance(self._transport, ThreadedPortTransport):
+            # rfc2217 waits for the terminal server to confirm the new settings
+            await asyncio.get_running_loop().run_in_executor(
+                None, setattr, ser, "baudrate", baudrate
+            )
+        else:
+            ser.baudrate = baudrate
+
+    @staticmethod
+    async def _sleep_until(deadline):
+        """Sleep until the loop time reaches deadline."""
+        await asyncio.sleep(max(0.0, deadline - asyncio.get_running_loop().time()))
+
+    def close(self):
+        """Close the serial transport."""
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+            self._protocol = None
+
+    async def listen(self):
+        """Decode the frames a mode D meter pushes until the hub stops."""
+        meter = self._hub.meters[0]
+        meter.parser = self._hub.select_parser(meter)
+        decoder = PushDecoder()
+        loop = asyncio.get_running_loop()
+        # every pushed frame counts as a readout cycle, timed from its first byte
+        started = None
+        received = 0
+        try:
+            while self._hub._running:
+                try:
+                    if self._transport is None:
+                        await self._connect(self._hub.push_baudrate)
+                        if self._transport is None:
+                            break
+                        decoder = PushDecoder()
+                        started = None
+                        received = 0
+                    data = await self._protocol.read_chunk(INTER_CHARACTER_TIMEOUT)
+                except PORT_ERRORS as exc:
+                    self._connection_failed(exc)
+                    continue
+                now = loop.time()
+                if data:
+                    if started is None:
+                        started = now
+                    received += len(data)
+                    frames = decoder.feed(data)
+                else:
+                    frame = decoder.timeout()
+                    frames = [frame] if frame is not None else []
+                for identification, message, status in frames:
+                    good = self._hub.handle_push_frame(meter, identification, message, status)
+                    self._hub.cycle_done(good, now - (started or now), received)
+                    started = None
+                    received = 0
+                if not data:
+                    # bytes the decoder dropped while resynchronizing are not a frame
+                    started = None
+                    received = 0
+        finally:
+            self.close()
+
+    async def run(self):
+        """Read the data from the port until the hub stops."""
+        if self._hub.push_mode:
+            await self.listen()
+            return
+        meters = self._hub.meters
+        for meter in meters:
+            meter.parser = self._hub.select_parser(meter)
+        scheduler = self._hub.scheduler
+        loop = asyncio.get_running_loop()
+        scheduler.start(loop.time())
+        pending = meters
+        try:
+            while self._hub._running:
+                await asyncio.sleep(scheduler.delay(loop.time()))
+                if not self._hub._running:
+                    break
+                if not scheduler.retrying:
+                    pending = meters
+                # meters on one bus are polled round-robin over the open port
+                failed = []
+                for meter in pending:
+                    started = loop.time()
+                    protocol = None
+                    try:
+                        if self._transport is None:
+                            await self._connect()
+                            if self._transport is None:
+                                # stopped while waiting for the port
+                                break
+                        protocol = self._protocol
+                        received = protocol.received
+                        done = await self._readout(meter)
+                    except PORT_ERRORS as exc:
+                        self._connection_failed(exc)
+                        done = False
+                    except Exception:
+                        # a meter sending nonsense must not end the readout for good
+                        _LOGGER.exception("Readout of meter %s failed", meter.address or self._port)
+                        done = False
+                    self._hub.cycle_done(
+                        done,
+                        loop.time() - started,
+                        protocol.received - received if protocol is not None else 0,
+                    )
+                    if not done:
+                        failed.append(meter)
+                if failed:
+                    # a retry polls only the meters that did not answer
+                    pending = failed
+                    scheduler.retry(loop.time())
+                else:
+                    scheduler.cycle_done(loop.time())
+        finally:
+            self.close()
+
+    async def _readout(self, meter):
+        """Run one sign-on and data readout cycle, return True if a data message was read."""
+        protocol = self._protocol
+        loop = asyncio.get_running_loop()
+        timing = meter.timing
+
+        request = sign_on(meter.address)
+        await self._set_baudrate(INITIAL_BAUDRATE)
+        protocol.reset_input()
+        sent = loop.time()
+        self._write(request)
+
+        identification = await protocol.read_line(
+            timeout=response_timeout(len(request), INITIAL_BAUDRATE)
+        )
+        if identification is None:
+            _LOGGER.debug("Brak odpowiedzi na first request")
+            if self._hub.trace.enabled:
+                self._hub.trace.record(EVENT, note="no identification")
+            return False
+        received = loop.time()
+        timing.observe_response(
+            protocol.first_byte_at - sent - transmit_time(len(request), INITIAL_BAUDRATE)
+        )
+        self._hub.metrics.observe("sign_on_latency", protocol.first_byte_at - sent)
+        # modes A and B answer without an ACK, time their data from here
+        protocol.mark()
+        _LOGGER.debug("Identification Message is %s", identification)
+
+        error = check_identification(identification)
+        if error is not None:
+            _LOGGER.warning("%s, abort query", error)
+            return False
+
+        meter.parser = self._hub.parser_for(meter, identification)
+        if meter.parser is None:
+            return False
+        self._hub.handle_identification(meter, identification)
+
+        mode, baudrate, baud_char = protocol_mode(identification)
+        if mode == 'C' and self._fixed_baudrate:
+            # a raw ser2net port cannot follow a speed change, keep the meter at 300 baud
+            baud_char, baudrate = INITIAL_BAUD_CHAR, INITIAL_BAUDRATE
+        registers = self._hub.registers_for_cycle(meter, mode)
+        if mode == 'C':
+            # the speed change in communication is initiated from the reading device,
+            # no sooner than the turnaround this meter accepts
+            await self._sleep_until(received + timing.turnaround)
+            _LOGGER.debug(
+                "Using protocol mode C, send acknowledge and tell smartmeter to switch to %s Baud",
+                baudrate,
+            )
+            if registers is None:
+                ack = acknowledge(baud_char)
+            else:
+                ack = acknowledge(baud_char, ACTION_PROGRAMMING)
+            protocol.mark()
+            sent = loop.time()
+            self._write(ack)
+            # switch once the ACK is on the wire, the meter answers tr later
+            await self._sleep_until(sent + transmit_time(len(ack), INITIAL_BAUDRATE) + MARGIN)
+            if baudrate != INITIAL_BAUDRATE:
+                await self._set_baudrate(baudrate)
+        elif mode == 'B' and baudrate != INITIAL_BAUDRATE:
+            # the meter switches right after the identification message
+            await self._set_baudrate(baudrate)
+
+        if registers is not None:
+            _LOGGER.debug("READ %s OBIS registers", len(registers))
+            message, status = await self._read_registers(registers)
+        else:
+            message, status = await self._read_data_message()
+        if mode == 'C':
+            # garbage or a NAK is not an answer, only a framed message shows the meter heard the ACK
+            timing.acknowledge_done(message.started)
+        if protocol.first_byte_at is not None:
+            self._hub.metrics.observe("first_data", protocol.first_byte_at - received)
+        self._hub.handle_data_message(meter, message, status)
+        return status == FRAME_GOOD
+
+    async def _read_data_message(self):
+        """Read the data message of a full readout, return (DataMessage, status)."""
+        protocol = self._protocol
+        loop = asyncio.get_running_loop()
+        _LOGGER.debug("READ Full OBIS DATA")
+        starttime = loop.time()
+        message = DataMessage()
+        status = FRAME_TRUNCATED
+        while True:
+            response = await protocol.read_line()
+            if response is None:
+                # the meter went silent for longer than the IEC inter-character timeout
+                _LOGGER.debug("No data received OBIS, data message ended without '!'")
+                break
+
+            if loop.time() - starttime > self._hub.max_readout_time:
+                _LOGGER.debug("Przerwanie petli odczytu OBIS po %s s", self._hub.max_readout_time)
+                break
+
+            message.add_line(response)
+            if is_end_of_data(response):
+                status = message.verify(await protocol.read(2))
+                break
+        return message, status
+
+    async def _read_block(self):
+        """Read one block up to ETX and check its BCC, return (block, status, received)."""
+        block = await self._protocol.read_line(end_byte=ETX)
+        if block is None:
+            return None, verify_block(None, None), None
+        check = await self._protocol.read(1)
+        status = verify_block(block, check)
+        if self._hub.trace.enabled:
+            self._hub.trace.record(RX, block, status)
+        return block, status, asyncio.get_running_loop().time()
+
+    async def _read_registers(self, registers):
+        """Read registers one by one in programming mode, return (DataMessage, status)."""
+        operand, status, received = await self._read_block()
+        if status != FRAME_GOOD:
+            _LOGGER.debug("No programming mode operand message: %s", operand)
+            return DataMessage(), status
+        lines = []
+        for address in registers:
+            # tr applies to the reader as well
+            await self._sleep_until(received + TR_MIN + MARGIN)
+            self._write(read_command(address, self._hub.read_command))
+            block, status, received = await self._read_block()
+            if status != FRAME_GOOD:
+                break
+            line = register_line(address, block)
+            if line is None:
+                _LOGGER.debug("Meter has no register %s: %s", address, block)
+                continue
+            lines.append(line)
+        if received is not None:
+            await self._sleep_until(received + TR_MIN + MARGIN)
+        self._write(BREAK)
+        return DataMessage(lines), status
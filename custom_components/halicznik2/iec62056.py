@@ -0,0 +1,391 @@
+"""
+IEC 62056-21 (D0) protocol helpers.
+
+Shared by the threaded reader in LiHub and the asyncio engine.
+"""
+import operator
+import re
+import time
+from functools import reduce
+
+from .timing import TA_MAX, TR_MAX
+
+SOH = 0x01  # start of header
+STX = 0x02  # start of text
+ETX = 0x03  # end of text
+ACK = 0x06  # acknowledge
+CR = 0x0D  # carriage return
+LF = 0x0A  # linefeed
+
+SIGN_ON = b"/?!\r\n"
+# device addresses are at most 32 characters
+MAX_DEVICE_ADDRESS = 32
+
+INITIAL_BAUDRATE = 300
+# baudrate character of the ACK that keeps the meter at the initial baudrate
+INITIAL_BAUD_CHAR = '0'
+
+Baudrates_Protocol_Mode_A = 300
+Baudrates_Protocol_Mode_B = {'A': 600, 'B': 1200, 'C': 2400, 'D': 4800, 'E': 9600, 'F': 19200}
+Baudrates_Protocol_Mode_C = {'0': 300, '1': 600, '2': 1200, '3': 2400, '4': 4800, '5': 9600, '6': 19200}
+
+ACTION_DATA_READOUT = '0'
+ACTION_PROGRAMMING = '1'
+NAK = 0x15  # negative acknowledge
+
+# default read timeouts, see timing.py
+RESPONSE_TIMEOUT = TR_MAX
+INTER_CHARACTER_TIMEOUT = TA_MAX
+
+# data set: address(value*unit)(secvalue), some meters put ' ' instead of '*'
+DATA_SET_RE = re.compile(
+    r"^(?P<address>[^(\r\n]+)"
+    r"\((?P<value>[^*() \r\n]*)(?:[* ](?P<unit>[^()\r\n]*))?\)"
+    r"(?:\((?P<secvalue>[^()\r\n]*)\))?",
+    re.MULTILINE,
+)
+
+# identification message in a pushed stream, possibly behind line noise
+PUSH_IDENTIFICATION_RE = re.compile(rb"/[A-Za-z]{3}[0-9A-Z][ -~]*\r\n\Z")
+
+# outcome of a data message readout
+FRAME_GOOD = "good"
+FRAME_BAD = "bad"
+FRAME_TRUNCATED = "truncated"
+
+# drop consumed bytes from the front of the buffer once this many piled up
+COMPACT_THRESHOLD = 4096
+
+
+def sign_on(address=""):
+    """Build the request message, an address selects one meter on a multidrop bus."""
+    if not address:
+        return SIGN_ON
+    return b"/?" + address.encode("ascii") + b"!\r\n"
+
+
+def protocol_mode(identification):
+    """
+    Return (mode, baudrate, baudrate character) announced by the meter.
+
+    Identification message: '/' + 3 chars manufacturer + 1 char baudrate + model + CR LF
+    """
+    baud_char = chr(identification[4])
+    mode, baudrate = baudrate_mode(baud_char)
+    return mode, baudrate, baud_char
+
+
+def baudrate_mode(baud_char):
+    """Return (mode, baudrate) for the baudrate character of an identification or ACK."""
+    if baud_char in Baudrates_Protocol_Mode_B:
+        return 'B', Baudrates_Protocol_Mode_B[baud_char]
+    if baud_char in Baudrates_Protocol_Mode_C:
+        # could also be 'E' but it doesn't make any difference here
+        return 'C', Baudrates_Protocol_Mode_C[baud_char]
+    return 'A', Baudrates_Protocol_Mode_A
+
+
+def acknowledge(baud_char, action=ACTION_DATA_READOUT):
+    """Build the ACK/option select message: ACK '0' Z Y CR LF."""
+    return bytes('\x060' + baud_char + action + '\r\n', 'ascii')
+
+
+def check_identification(identification):
+    """Return an error description if the identification message is unusable, else None."""
+    # need at least 7 bytes:
+    # 1 byte "/"
+    # 3 bytes short Identification
+    # 1 byte speed indication
+    # 2 bytes CR LF
+    if len(identification) < 7:
+        return "malformed identification message: '{}'".format(identification)
+    if identification[0] != 0x2F:
+        return "identification message '{}' does not start with '/'".format(identification)
+    return None
+
+
+def is_end_of_data(line):
+    """Return True for the '!' line that closes a data message (ETX and BCC follow it)."""
+    return line.lstrip(b'\x02').startswith(b'!')
+
+
+def iter_data_sets(lines):
+    """Yield (address, value, unit, secvalue) for every data set of a data message."""
+    text = b"".join(lines).decode("ascii", "replace")
+    for match in DATA_SET_RE.finditer(text):
+        address, value, unit, secvalue = match.groups()
+        yield address, value, unit or "", secvalue or ""
+
+
+def bcc(data, value=0):
+    """Fold data into the XOR block check character."""
+    return reduce(operator.xor, data, value)
+
+
+def command_message(command, data=None):
+    """Build the command message SOH C D [STX data] ETX BCC."""
+    body = command
+    if data is not None:
+        body += bytes((STX,)) + data
+    body += bytes((ETX,))
+    return bytes((SOH,)) + body + bytes((bcc(body),))
+
+
+def read_command(address, command=b"R1"):
+    """Build the programming mode read command for one register."""
+    return command_message(command, address.encode("ascii") + b"()")
+
+
+BREAK = command_message(b"B0")
+
+
+def verify_block(block, check):
+    """Check the BCC of a block ending in ETX, the BCC starts after its first SOH or STX."""
+    if block is None or not check:
+        return FRAME_TRUNCATED
+    starts = [index for index in (block.find(SOH), block.find(STX)) if index >= 0]
+    if not starts or block[-1] != ETX:
+        return FRAME_BAD
+    if bcc(block[min(starts) + 1:]) != check[0]:
+        return FRAME_BAD
+    return FRAME_GOOD
+
+
+def register_line(address, block):
+    """Turn the answer to a read command into a data set line, None for an error answer."""
+    payload = block[block.find(STX) + 1:-1]
+    if payload.startswith(b"(ERROR") or not payload:
+        return None
+    if payload.startswith(b"("):
+        # the meter left the address out of the answer
+        payload = address.encode("ascii") + payload
+    return payload + b"\r\n"
+
+
+class DataMessage:
+    """
+    Lines of one data message: STX data-block '!' CR LF ETX BCC.
+
+    The BCC is computed while the lines arrive, it covers everything after
+    STX up to and including ETX.
+    """
+
+    def __init__(self, lines=None):
+        """Initialize the message, lines are given for already verified register answers."""
+        self.lines = lines if lines is not None else []
+        self._bcc = 0
+        # register answers follow an operand message that was framed and verified
+        self._started = lines is not None
+
+    def add_line(self, line):
+        """Add a received line, the '!' line is only folded into the BCC."""
+        if not self._started:
+            index = line.find(STX)
+            if index >= 0:
+                line = line[index + 1:]
+                self._started = True
+        self._bcc = bcc(line, self._bcc)
+        if not is_end_of_data(line):
+            self.lines.append(line)
+
+    @property
+    def started(self):
+        """Return True once the STX was seen, the meter is talking at the agreed baudrate."""
+        return self._started
+
+    def verify(self, trailer):
+        """Check the ETX + BCC trailer, return FRAME_GOOD, FRAME_BAD or FRAME_TRUNCATED."""
+        if trailer is None or len(trailer) < 2 or not self._started:
+            return FRAME_TRUNCATED
+        if trailer[0] != ETX:
+            return FRAME_BAD
+        if self._bcc ^ ETX != trailer[1]:
+            return FRAME_BAD
+        return FRAME_GOOD
+
+
+class FrameBuffer:
+    """
+    Reusable receive buffer.
+
+    Bytes are appended in bulk and lines are cut off the front by moving a
+    read offset, the consumed head is only dropped once it grows large.
+    """
+
+    def __init__(self):
+        """Initialize the buffer."""
+        self._data = bytearray()
+        self._start = 0
+
+    def __len__(self):
+        """Return the number of unread bytes."""
+        return len(self._data) - self._start
+
+    def clear(self):
+        """Forget all buffered bytes."""
+        del self._data[:]
+        self._start = 0
+
+    def feed(self, data):
+        """Append received bytes."""
+        self._data += data
+
+    def _consume(self, end):
+        """Return the bytes up to end and advance the read offset."""
+        with memoryview(self._data) as view:
+            chunk = bytes(view[self._start:end])
+        self._start = end
+        if self._start == len(self._data):
+            self.clear()
+        elif self._start > COMPACT_THRESHOLD:
+            del self._data[:self._start]
+            self._start = 0
+        return chunk
+
+    def pop_line(self, end_byte=LF):
+        """Return the next line including end_byte, or None if it is incomplete."""
+        index = self._data.find(end_byte, self._start)
+        if index < 0:
+            return None
+        return self._consume(index + 1)
+
+    def pop(self, size):
+        """Return the next size bytes, or None if fewer are buffered."""
+        if len(self) < size:
+            return None
+        return self._consume(self._start + size)
+
+
+class PushDecoder:
+    """
+    Cut frames out of the stream of a meter pushing in protocol mode D.
+
+    Bytes before the first identification message and the rest of a broken
+    frame are dropped, decoding picks up again at the next identification
+    message. Meters that push without STX send no ETX/BCC either, their
+    frames are complete at the '!' line.
+    """
+
+    def __init__(self):
+        """Initialize the decoder, waiting for an identification message."""
+        self.buffer = FrameBuffer()
+        self._reset()
+
+    def _reset(self):
+        """Wait for the next identification message."""
+        self.identification = None
+        self.message = None
+        self._end_of_data = False
+
+    def _finish(self, status):
+        """Return the frame in progress with its status and start over."""
+        frame = (self.identification, self.message, status)
+        self._reset()
+        return frame
+
+    def feed(self, data):
+        """Add received bytes, return (identification, DataMessage, status) for every frame they complete."""
+        self.buffer.feed(data)
+        frames = []
+        while True:
+            if self._end_of_data:
+                if self.message.started:
+                    trailer = self.buffer.pop(2)
+                    if trailer is None:
+                        break
+                    frames.append(self._finish(self.message.verify(trailer)))
+                else:
+                    frames.append(self._finish(FRAME_GOOD))
+                continue
+            line = self.buffer.pop_line()
+            if line is None:
+                break
+            match = PUSH_IDENTIFICATION_RE.search(line)
+            if match is not None:
+                if self.identification is not None:
+                    # the previous frame broke off
+                    frames.append(self._finish(FRAME_TRUNCATED))
+                self.identification = match.group()
+                self.message = DataMessage()
+                continue
+            if self.identification is None:
+                # resynchronizing
+                continue
+            self.message.add_line(line)
+            if is_end_of_data(line):
+                self._end_of_data = True
+        return frames
+
+    def timeout(self):
+        """The stream went silent, return the frame in progress as truncated, or None."""
+        self.buffer.clear()
+        if self.identification is None:
+            return None
+        return self._finish(FRAME_TRUNCATED)
+
+
+class SerialLineReader:
+    """
+    Buffered line reader on top of a blocking serial.Serial.
+
+    Everything waiting in the driver is drained with one read() call. The
+    port timeout only bounds a single blocking read, the IEC response and
+    inter-character timeouts are enforced as deadlines.
+    """
+
+    def __init__(self, ser):
+        """Initialize the reader."""
+        self._ser = ser
+        self.buffer = FrameBuffer()
+        # monotonic time the first byte arrived since the last reset() or mark()
+        self.first_byte_at = None
+        # bytes read from the port since it was opened
+        self.received = 0
+
+    def reset(self):
+        """Drop buffered and pending input before a new request."""
+        self.buffer.clear()
+        self._ser.reset_input_buffer()
+        self.first_byte_at = None
+
+    def mark(self):
+        """Start timing the answer to the next request."""
+        self.first_byte_at = None
+
+    def _fill(self, deadline, inter_character_timeout):
+        """Read more bytes into the buffer, return the new deadline or None on timeout."""
+        while True:
+            chunk = self._ser.read(self._ser.in_waiting or 1)
+            now = time.monotonic()
+            if chunk:
+                if self.first_byte_at is None:
+                    self.first_byte_at = now
+                self.received += len(chunk)
+                self.buffer.feed(chunk)
+                return now + inter_character_timeout
+            if now >= deadline:
+                return None
+
+    def read_line(self, end_byte=LF, timeout=RESPONSE_TIMEOUT,
+                  inter_character_timeout=INTER_CHARACTER_TIMEOUT):
+        """Return the next line including end_byte, or None on timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            line = self.buffer.pop_line(end_byte)
+            if line is not None:
+                return line
+            deadline = self._fill(deadline, inter_character_timeout)
+            if deadline is None:
+                return None
+
+    def read(self, size, timeout=RESPONSE_TIMEOUT,
+             inter_character_timeout=INTER_CHARACTER_TIMEOUT):
+        """Return exactly size bytes, or None on timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            data = self.buffer.pop(size)
+            if data is not None:
+                return data
+            deadline = self._fill(deadline, inter_character_timeout)
+            if deadline is None:
+                return None
@@ -0,0 +1,129 @@
+"""
+Readout cycle metrics.
+
+Both engines time every readout cycle. Each metric keeps a small fixed
+bucket histogram besides count, sum, min, max and the last value, so memory
+does not grow with uptime:
+
+    sign_on_latency    sign-on written until the first byte of the identification
+    first_data         identification received until the first byte of data
+    bytes_received     bytes the meter sent during the cycle
+    bytes_per_second   bytes received over the cycle duration
+    parse_time         parsing the data message and deriving values
+    dispatch_time      creating sensors and signalling changed registers
+    retries            failed attempts before a data message was read
+    cycle_duration     sign-on until the data message was handled
+
+A frame pushed by a mode D meter counts as one cycle, timed from its first
+byte.
+"""
+from bisect import bisect_left
+from typing import NamedTuple, Tuple
+
+TIME_BOUNDS = (0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30, 60, 120)
+CPU_BOUNDS = (0.0001, 0.0003, 0.001, 0.003, 0.01, 0.03, 0.1, 0.3)
+SIZE_BOUNDS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+RATE_BOUNDS = (10, 30, 60, 120, 240, 480, 960, 1920)
+COUNT_BOUNDS = (0, 1, 2, 3, 5, 10)
+
+
+class MetricInfo(NamedTuple):
+    """Description, unit and histogram bucket bounds of a metric."""
+
+    description: str
+    unit: str
+    bounds: Tuple[float, ...]
+
+
+METRICS = {
+    "sign_on_latency": MetricInfo("Sign-on latency", "s", TIME_BOUNDS),
+    "first_data": MetricInfo("Identification to first data", "s", TIME_BOUNDS),
+    "bytes_received": MetricInfo("Bytes received per cycle", "B", SIZE_BOUNDS),
+    "bytes_per_second": MetricInfo("Effective throughput", "B/s", RATE_BOUNDS),
+    "parse_time": MetricInfo("Parse time", "s", CPU_BOUNDS),
+    "dispatch_time": MetricInfo("Dispatch time", "s", CPU_BOUNDS),
+    "retries": MetricInfo("Retries per cycle", "", COUNT_BOUNDS),
+    "cycle_duration": MetricInfo("Cycle duration", "s", TIME_BOUNDS),
+}
+
+
+class Histogram:
+    """Fixed bucket histogram, a value lands in the first bucket whose bound is not below it."""
+
+    __slots__ = ("bounds", "buckets", "count", "total", "minimum", "maximum", "last")
+
+    def __init__(self, bounds):
+        """Initialize an empty histogram, one more bucket than bounds collects the overflow."""
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.last = None
+
+    def observe(self, value):
+        """Add a value."""
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.last = value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    @property
+    def mean(self):
+        """Return the mean of all values, None before the first one."""
+        return self.total / self.count if self.count else None
+
+    def as_dict(self):
+        """Return the histogram for diagnostics, buckets keyed by their upper bound."""
+        buckets = {"<={}".format(bound): count for bound, count in zip(self.bounds, self.buckets)}
+        buckets[">{}".format(self.bounds[-1])] = self.buckets[-1]
+        return {
+            "count": self.count,
+            "last": self.last,
+            "mean": self.mean,
+            "min": self.minimum,
+            "max": self.maximum,
+            "buckets": buckets,
+        }
+
+
+class ReadoutMetrics:
+    """Histograms of the readout cycles of one hub."""
+
+    def __init__(self):
+        """Initialize one histogram per metric."""
+        self.histograms = {name: Histogram(info.bounds) for name, info in METRICS.items()}
+        self.cycles = 0
+        self.failed_cycles = 0
+        self._retries = 0
+
+    def observe(self, name, value):
+        """Add a value to the histogram of a metric."""
+        self.histograms[name].observe(value)
+
+    def cycle_done(self, good, duration, received):
+        """Record the end of a readout cycle, good tells if a data message was read."""
+        self.cycles += 1
+        if not good:
+            self.failed_cycles += 1
+            self._retries += 1
+            return
+        self.observe("retries", self._retries)
+        self._retries = 0
+        self.observe("cycle_duration", duration)
+        self.observe("bytes_received", received)
+        if duration > 0:
+            self.observe("bytes_per_second", received / duration)
+
+    def as_dict(self):
+        """Return all metrics for diagnostics."""
+        return {
+            "cycles": self.cycles,
+            "failed_cycles": self.failed_cycles,
+            "histograms": {name: histogram.as_dict() for name, histogram in self.histograms.items()},
+        }
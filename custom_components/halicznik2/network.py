@@ -0,0 +1,75 @@
+"""
+Network serial ports.
+
+Meters behind ser2net or another terminal server are configured with a
+pyserial URL, socket://host:port for a raw TCP port or rfc2217://host:port
+where the reader may switch baudrate and parity remotely. The connection is
+opened once and kept for all readout cycles, TCP keepalive notices a dead
+terminal server between them.
+"""
+import socket
+import termios
+import urllib.parse as urlparse
+
+import serial
+
+# what opening or using a port raises once the adapter is gone, pyserial lets
+# errors of configuring the terminal through unwrapped
+PORT_ERRORS = (serial.SerialException, OSError, termios.error)
+
+# URL schemes of ports reached over the network
+NETWORK_SCHEMES = ("socket", "rfc2217")
+
+# seconds of idle connection before the first keepalive probe, between the
+# probes, and the number of unanswered probes that close the connection
+KEEPALIVE_IDLE = 30
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 3
+
+
+def is_url(port):
+    """Return True if the port is a pyserial URL rather than a device path."""
+    return "://" in port
+
+
+def is_network_port(port):
+    """Return True if the port is reached over the network."""
+    return urlparse.urlsplit(port).scheme in NETWORK_SCHEMES
+
+
+def has_fixed_baudrate(port):
+    """Return True if the reader cannot change the baudrate, a raw TCP port keeps its speed."""
+    return urlparse.urlsplit(port).scheme == "socket"
+
+
+def enable_keepalive(ser):
+    """Turn on TCP keepalive and disable Nagle for a network port, other ports are left alone."""
+    sock = getattr(ser, "_socket", None)
+    if sock is None:
+        return
+    # the sign-on and ACK are a few bytes, send them at once
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for option, value in (
+        ("TCP_KEEPIDLE", KEEPALIVE_IDLE),
+        ("TCP_KEEPINTVL", KEEPALIVE_INTERVAL),
+        ("TCP_KEEPCNT", KEEPALIVE_COUNT),
+    ):
+        # not every platform has the fine grained options
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+
+def open_port(port, baudrate, timeout):
+    """Open a local device or pyserial URL for 7E1 and return the serial object."""
+    ser = serial.serial_for_url(
+        port,
+        baudrate=baudrate,
+        parity=serial.PARITY_EVEN,
+        stopbits=serial.STOPBITS_ONE,
+        bytesize=serial.SEVENBITS,
+        timeout=timeout,
+    )
+    if is_network_port(port):
+        enable_keepalive(ser)
+    return ser
@@ -0,0 +1,146 @@
+"""
+OBIS code registry.
+
+Codes are stored as parsed A-B:C.D.E*F tuples with typed metadata. The
+registry is built once at import time and shared by the meter parsers.
+"""
+import re
+from typing import NamedTuple, Optional, Union
+
+# A-B:C.D.E*F, A-B, E and F are optional, '&' is an alternative billing period separator
+OBIS_RE = re.compile(
+    r"^(?:(?P<a>\d+)-(?P<b>\d+):)?"
+    r"(?P<c>[0-9A-Z]+)\.(?P<d>[0-9A-Z]+)(?:\.(?P<e>[0-9A-Z]+))?"
+    r"(?:[*&](?P<f>\d+))?$"
+)
+
+Group = Optional[Union[int, str]]
+
+
+class ObisCode(NamedTuple):
+    """Parsed OBIS code, missing groups are None."""
+
+    a: Group
+    b: Group
+    c: Group
+    d: Group
+    e: Group
+    f: Group
+
+    @property
+    def channel(self):
+        """Return the code with medium, channel and billing period left out."""
+        return ObisCode(None, None, self.c, self.d, self.e, None)
+
+    def __str__(self):
+        """Return the code in A-B:C.D.E*F notation."""
+        text = "{}.{}".format(self.c, self.d)
+        if self.e is not None:
+            text += ".{}".format(self.e)
+        if self.a is not None:
+            text = "{}-{}:{}".format(self.a, self.b, text)
+        if self.f is not None:
+            text += "*{}".format(self.f)
+        return text
+
+
+class ObisInfo(NamedTuple):
+    """Metadata of an OBIS register."""
+
+    description: str
+    unit: str = ""
+    numeric: bool = False
+    state_class: Optional[str] = None
+    device_class: Optional[str] = None
+
+
+def _group(value):
+    """Normalize one code group, '08' and '8' are the same group."""
+    if value is None:
+        return None
+    return int(value) if value.isdigit() else value
+
+
+def parse_obis(address):
+    """Return the ObisCode for an address string, or None if it is not an OBIS code."""
+    match = OBIS_RE.match(address.strip())
+    if match is None:
+        return None
+    return ObisCode(*(_group(value) for value in match.groups()))
+
+
+class ObisRegistry:
+    """
+    OBIS codes with their metadata.
+
+    Lookups try the exact code first, then the code without billing period
+    and finally the bare C.D.E channel, so a register defined as "15.8.0"
+    matches "1-0:15.8.0" and "15.8.0*00" as well. Results are cached per
+    address string, repeated lookups are a single dict access.
+    """
+
+    def __init__(self, entries=None, parent=None):
+        """Initialize the registry from a {address: ObisInfo} mapping."""
+        self._codes = dict(parent._codes) if parent is not None else {}
+        self._cache = {}
+        for address, info in (entries or {}).items():
+            self.add(address, info)
+
+    def add(self, address, info):
+        """Register metadata for an address."""
+        code = parse_obis(address)
+        if code is None:
+            raise ValueError("Not an OBIS code: {}".format(address))
+        self._codes[code] = info
+        self._cache.clear()
+
+    def extend(self, entries):
+        """Return a new registry with these entries added on top of this one."""
+        return ObisRegistry(entries, parent=self)
+
+    def lookup(self, address):
+        """Return (ObisCode, ObisInfo) for an address, either may be None."""
+        try:
+            return self._cache[address]
+        except KeyError:
+            pass
+        code = parse_obis(address)
+        info = None
+        if code is not None:
+            info = self._codes.get(code)
+            if info is None and code.f is not None:
+                info = self._codes.get(code._replace(f=None))
+            if info is None:
+                info = self._codes.get(code.channel)
+        self._cache[address] = result = (code, info)
+        return result
+
+    def get(self, address):
+        """Return the ObisInfo for an address, or None."""
+        return self.lookup(address)[1]
+
+    def __contains__(self, address):
+        """Return True if the address has metadata."""
+        return self.get(address) is not None
+
+    def codes(self):
+        """Return the registered codes."""
+        return list(self._codes)
+
+
+OBIS = ObisRegistry(
+    {
+        "0.0.0": ObisInfo("Serial number"),
+        "0.9.1": ObisInfo("Czas"),
+        "0.9.2": ObisInfo("Data"),
+        "1.8.0": ObisInfo("Energia czynna pobrana", "kWh", True, "total_increasing", "energy"),
+        "2.8.0": ObisInfo("Energia czynna oddana", "kWh", True, "total_increasing", "energy"),
+        "15.8.0": ObisInfo("Sum total", "kWh", True, "total_increasing", "energy"),
+        "31.7.0": ObisInfo("Prąd chwilowy, faza L1", "A", True, "measurement", "current"),
+        "32.7.0": ObisInfo("Napięcie chwilowe, faza L1", "V", True, "measurement", "voltage"),
+        "51.7.0": ObisInfo("Prąd chwilowy, faza L2", "A", True, "measurement", "current"),
+        "52.7.0": ObisInfo("Napięcie chwilowe, faza L2", "V", True, "measurement", "voltage"),
+        "71.7.0": ObisInfo("Prąd chwilowy, faza L3", "A", True, "measurement", "current"),
+        "72.7.0": ObisInfo("Napięcie chwilowe, faza L3", "V", True, "measurement", "voltage"),
+    }
+)
@@ -6,176 +6,52 @@ This module will decode the incoming message from Mbus serial.
 import logging
 from datetime import datetime
 
-_LOGGER = logging.getLogger(__name__)
-
-kody = {'1-0:15.8.0': ['Sum total', 'kWh', 'TAK','total_increasing'],
-        '1-0:0.0.0': ['Serial number', '', 'NIE'],
-        '1-0:31.7.0': ['Prąd chwilowy, faza L1', '', 'TAK'],
-        '1-0:32.7.0': ['Napięcie chwilowe, faza L1', '', 'TAK'],
-        '1-0:51.7.0': ['Prąd chwilowy, faza L2', '', 'TAK'],
-        '1-0:52.7.0': ['Napięcie chwilowe, faza L2', '', 'TAK'],
-        '1-0:71.7.0': ['Prąd chwilowy, faza L3', '', 'TAK'],
-        '1-0:72.7.0': ['Napięcie chwilowe, faza L3', '', 'TAK'],
-        }
-
-
-def parse_data(stored, data, reqs = None):
-    """Parse the incoming data to dict."""
-    sensor_data = {}
-    han_data = {}
-    pkt = data
-    # current date and time
-    now = datetime.now()
-
-    #reqs = reqs.decode()
-
-    try:
-        reqs = str(reqs)
-        manid = reqs[1:4]
-    except:
-        manid = " "
-
-    try:
-        modelid = reqs[7:13]
-    except:
-        modelid = " "
-
-    if (pkt != ""):
-        try:
-            pkt = pkt.decode()
-            x = pkt.split('(')
-        except:
-            pass
-        if (len (x) > 0):
+from ..iec62056 import iter_data_sets
+from ..obis import OBIS
+from ..readings import Reading
 
-            address = x[0]
-            _LOGGER.debug("adress data: {}".format(address))
-
-            pierwszy_znak = address[0]
+_LOGGER = logging.getLogger(__name__)
 
-            if pierwszy_znak == '!' or pierwszy_znak == '/':
-                _LOGGER.debug("adress is ont correct : {} skipping".format(address))
-                #stored.update(sensor_data)
-                return {}, han_data
+# the standard registers are shared through the central registry
+OBIS_CODES = OBIS
 
-            if pierwszy_znak.isdigit() == False:
-                _LOGGER.debug("First char isn't a numeric: {} breake".format(address))
-                #stored.update(sensor_data)
-                return {}, han_data
 
-            try:
-                if (len(x) > 2):
-                    wa = x[1][:-1].split('*')  # the standard seems to have a '*' instead of ' ' here
-                    try:
-                        unit = wa[1]
-                    except:
-                        pass
-                else:
-                    wa = x[1][:-2].split('*')  # the standard seems to have a '*' instead of ' ' here
-                    try:
-                        unit = wa[1]
-                    except:
-                        pass
-                value = wa[0]
-            except:
-                value = ""
-                return {}, han_data
+def parse_identification(identity, reqs):
+    """Fill the meter identity from the identification message."""
+    # a short identification would leave the CR LF in the slices
+    reqs = str(reqs).strip()
+    identity.update(reqs[1:4], "Energy", reqs[7:13])
 
-            if value.endswith(')'):
-                value = value[:-1]
-            kanal = 'BB'
-            device_class_str = " "
-            adresy = address.split('*')
-            if (len(adresy) > 1):
-                addressn = adresy[0]
-                kanal = str (adresy[1])
-            else:
-                addressn = address
-                kanal = ''
-            total_increasing_str = ''
-            if addressn in kody:
-                opis = kody.get(addressn)[0]
-                #unit = kody.get(addressn)[1]
 
-                if kody.get(addressn)[2] == 'TAK':
-                    try:
-                        value = float(value)
-                    except ValueError:
-                        pass
+def parse_telegram(stored, lines, identity):
+    """Parse all data sets of one data message into the stored readings."""
+    changed = []
+    # one capture time for the whole telegram
+    now = datetime.now()
 
+    for address, value, unit, secvalue in iter_data_sets(lines):
+        if not address[0].isdigit():
+            _LOGGER.debug("First char isn't a numeric: %s skipping", address)
+            continue
+
+        reading = stored.get(address)
+        if reading is None:
+            reading = stored[address] = Reading(
+                address, OBIS_CODES.get(address), identity, address.partition('*')[2]
+            )
+
+        info = reading.info
+        if info is not None:
+            unit = unit or info.unit
+            if info.numeric:
                 try:
-                    total_increasing_str = kody.get(addressn)[3]
-                    """
-                        unit_of_measurement: kWh
-                        device_class: energy
-                        state_class: total_increasing
-                    """
-                    device_class_str = "energy"
-                except:
-                    device_class_str = " "
-                    total_increasing_str = " "
+                    value = float(value)
+                except ValueError:
                     pass
+        else:
+            unit = ""
 
-            else:
-                unit = ""
-                opis = ""
-            '''
-            try:
-                unit = wa[1]
-            except:
-                pass
-            '''
-            if unit.endswith(')'):
-                unit = unit[:-1]
-
-            _LOGGER.debug("value = data: {}".format(value))
-
-            try:
-                secvalue = x[2][:-2]
-            except:
-                secvalue = ""
-
-            if secvalue.endswith(')'):
-                secvalue = secvalue[:-1]
-
-            sensor_data[address] = {
-                "state": value,
-                "attributes": {
-                    "Opis" : opis,
-                    "timestamp": now,
-                    #"meter_timestamp": "2021-02-13",
-                    "meter_manufacturer": manid,
-                    "meter_type": "Energy",
-                    "meter_serial": modelid,
-                    #"obis_code": address,
-                    "obis_telegram": pkt,
-                    "kanal": kanal,
-                    "reqs": reqs,
-                    "secvalue": secvalue,
-                    "state_class": total_increasing_str,
-                    "device_class": device_class_str,
-                    "unit_of_measurement": unit,
-                    "icon": "mdi:gauge",
-                },
-            }
-
-    """
-    han_data["obis_r_e_n"] = field_type(".", fields=pkt[240:246])
-    han_data["reactive_energy_n"] = byte_decode(fields=pkt[247:251]) / 100
-    sensor_data["ams_reactive_energy_export"] = {
-        "state": han_data["reactive_energy_n"],
-        "attributes": {
-            "timestamp": han_data["date_time"],
-            "meter_timestamp": han_data["meter_date_time"],
-            "meter_manufacturer": han_data["obis_list_version"].title(),
-            "meter_type": han_data["meter_type_str"],
-            "meter_serial": han_data["meter_serial"],
-            "obis_code": han_data["obis_r_e_n"],
-            "unit_of_measurement": "kVArh",
-            "icon": "mdi:gauge",
-        },
-    }
-    """
+        if reading.update(value, unit, secvalue, now):
+            changed.append(address)
 
-    stored.update(sensor_data)
-    return stored, han_data
+    return stored, changed
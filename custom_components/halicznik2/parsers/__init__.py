@@ -0,0 +1,57 @@
+"""
+Meter parsers.
+
+Every meter profile registers its manufacturer IDs and identification
+pattern here. The parser module, with its OBIS table, is only imported
+once the profile is selected in the configuration or detected on the port.
+"""
+import importlib
+import re
+from typing import NamedTuple, Pattern, Tuple
+
+
+class MeterProfile(NamedTuple):
+    """Registration of one meter parser."""
+
+    name: str
+    module: str
+    manufacturers: Tuple[str, ...]
+    pattern: Pattern
+
+
+PROFILES = {}
+
+
+def register_profile(name, module, manufacturers, pattern):
+    """Register a parser module for meters matching the identification pattern."""
+    PROFILES[name] = MeterProfile(
+        name, module, tuple(manufacturers), re.compile(pattern, re.IGNORECASE)
+    )
+
+
+# the model is what follows the baudrate character of the identification message
+register_profile("ec3", ".EC3", ("PAF",), r"EC3")
+register_profile("norax30", ".NORAX30", ("PAF",), r"NORAX|3D")
+
+
+def manufacturer_options():
+    """Return the choices for the meter_manufacturer option."""
+    return ["auto"] + list(PROFILES)
+
+
+def load_parser(name):
+    """Import and return the parser module of a profile, None for unknown names."""
+    profile = PROFILES.get(name)
+    if profile is None:
+        return None
+    return importlib.import_module(profile.module, __name__)
+
+
+def detect_parser(identification):
+    """Return the profile name for an identification message, or None."""
+    manufacturer = identification[1:4].upper()
+    model = identification[5:]
+    for profile in PROFILES.values():
+        if manufacturer in profile.manufacturers and profile.pattern.search(model):
+            return profile.name
+    return None
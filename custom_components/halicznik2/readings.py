@@ -0,0 +1,108 @@
+"""
+Compact reading records.
+
+One Reading per register, updated in place on every telegram, one
+MeterIdentity shared by all readings of a meter and one Meter per device
+address polled on a port.
+"""
+from .timing import MeterTiming
+
+
+class MeterIdentity:
+    """Manufacturer, type and serial of a meter."""
+
+    __slots__ = ("manufacturer", "type", "serial")
+
+    def __init__(self, manufacturer=None, type=None, serial=None):
+        """Initialize the identity."""
+        self.manufacturer = manufacturer
+        self.type = type
+        self.serial = serial
+
+    def update(self, manufacturer, type, serial):
+        """Set all fields at once."""
+        self.manufacturer = manufacturer
+        self.type = type
+        self.serial = serial
+
+    @property
+    def complete(self):
+        """Return True once manufacturer, type and serial are known."""
+        return bool(self.manufacturer and self.type and self.serial)
+
+
+class Reading:
+    """Latest value of one register."""
+
+    __slots__ = ("address", "info", "identity", "channel", "value", "unit", "status", "captured")
+
+    def __init__(self, address, info, identity, channel=""):
+        """Initialize an empty reading."""
+        self.address = address
+        self.info = info
+        self.identity = identity
+        self.channel = channel
+        self.value = None
+        self.unit = ""
+        self.status = ""
+        self.captured = None
+
+    def update(self, value, unit, status, captured):
+        """Store a new sample, return True if value, unit or status changed."""
+        self.captured = captured
+        if value == self.value and unit == self.unit and status == self.status:
+            return False
+        self.value = value
+        self.unit = unit
+        self.status = status
+        return True
+
+    @property
+    def state(self):
+        """Return the value as entity state."""
+        return self.value
+
+    @property
+    def attributes(self):
+        """Build the extra entity attributes, unit and classes are entity properties."""
+        info = self.info
+        identity = self.identity
+        return {
+            "Opis": info.description if info is not None else "",
+            "timestamp": self.captured,
+            "meter_manufacturer": identity.manufacturer,
+            "meter_type": identity.type,
+            "meter_serial": identity.serial,
+            "kanal": self.channel,
+            "secvalue": self.status,
+        }
+
+
+class Meter:
+    """One meter on a port, '' is the address of the broadcast sign-on."""
+
+    __slots__ = (
+        "address", "parser", "identity", "sensor_data", "cycles", "registers", "timing",
+        "derived", "identification",
+    )
+
+    def __init__(self, address=""):
+        """Initialize a meter that was not read yet."""
+        self.address = address
+        self.parser = None
+        self.identity = MeterIdentity()
+        self.sensor_data = {}
+        self.cycles = 0
+        # configured registers under the addresses of the full readout, None until resolved
+        self.registers = None
+        self.timing = MeterTiming()
+        # DerivedMetrics stage, set by the hub
+        self.derived = None
+        # identification message a detected parser was picked for
+        self.identification = None
+
+    def key(self, register):
+        """Return the hub wide name of a register, registers of addressed meters are prefixed."""
+        if not self.address:
+            return register
+        return "{}/{}".format(self.address, register)
@@ -0,0 +1,56 @@
+"""
+Readout scheduling.
+
+Sign-ons are placed on a fixed grid of period seconds, so the spacing of
+samples does not depend on how long a readout takes. Each hub gets a
+stable phase offset within jitter seconds, meters sharing a bus do not
+start at the same moment.
+"""
+import math
+import random
+
+RETRY_DELAY = 10  # seconds before a failed cycle is retried
+
+
+class ReadoutScheduler:
+    """Compute the deadline of the next sign-on."""
+
+    def __init__(self, period, jitter=0.0, seed=None, retry_delay=RETRY_DELAY):
+        """Initialize the scheduler, seed keeps the phase offset stable per hub."""
+        self.period = period
+        self.retry_delay = retry_delay
+        self.offset = random.Random(seed).uniform(0, jitter) if jitter else 0.0
+        self.deadline = None
+        # True while the deadline is a retry within the current slot
+        self.retrying = False
+        self._slot = None
+
+    def start(self, now):
+        """Schedule the first sign-on."""
+        self._slot = now + self.offset
+        self.deadline = self._slot
+        self.retrying = False
+
+    def _advance(self, now):
+        """Skip the slots that passed while a cycle overran."""
+        if self._slot + self.period <= now:
+            self._slot += math.floor((now - self._slot) / self.period) * self.period
+
+    def cycle_done(self, now):
+        """Schedule the sign-on after a finished cycle on the next free slot."""
+        self._advance(now)
+        self._slot += self.period
+        self.deadline = self._slot
+        self.retrying = False
+
+    def retry(self, now):
+        """Schedule a retry after a failed cycle, never later than the next slot."""
+        slot = self._slot
+        self._advance(now)
+        self.deadline = min(now + self.retry_delay, self._slot + self.period)
+        # once a new slot has begun, the next cycle is a full one again
+        self.retrying = self._slot == slot and self.deadline < self._slot + self.period
+
+    def delay(self, now):
+        """Return the seconds left until the deadline."""
+        return max(0.0, self.deadline - now)
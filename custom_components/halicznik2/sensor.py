@@ -2,55 +2,69 @@
 import logging
 from datetime import timedelta
 
+from homeassistant.components.sensor import SensorEntity
 from homeassistant.const import STATE_UNKNOWN
 from homeassistant.core import callback
 from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from homeassistant.helpers.entity import Entity, EntityCategory
 from homeassistant.helpers.restore_state import RestoreEntity
 from homeassistant.util import dt as dt_utils
 
 from .const import (
-    LICZNIK_DEVICES,
-    LICZNIK_SENSOR_CREATED_BUT_NOT_READ,
     DOMAIN,
     #HOURLY_SENSORS,
+    SIGNAL_CONNECTION_UPDATE,
+    SIGNAL_METRICS_UPDATE,
     SIGNAL_NEW_TELEGRAM_SENSOR,
     SIGNAL_UPDATE_TELEGRAM,
 )
+from .metrics import METRICS
 
 _LOGGER = logging.getLogger(__name__)
 
+# attributes a restored state carries that are entity properties now
+ENTITY_PROPERTIES = ("unit_of_measurement", "state_class", "device_class", "icon", "friendly_name")
+
+# connection sensors of a hub, kind -> name
+CONNECTION_SENSORS = {
+    "connection_state": "Connection state",
+    "reconnects": "Reconnects",
+}
+
 
 async def async_setup_entry(hass, config_entry, async_add_devices):
     """Setup sensor platform for the ui"""
+    hub = hass.data[DOMAIN][config_entry.entry_id]
 
     @callback
     def async_add_sensor():
 
         _LOGGER.debug("Start add sensor LICZNIK")
         sensors = []
-        data = hass.data[DOMAIN].sensor_data
+        data = hub.sensor_data
 
         for sensor_name in data:
             # Check that we dont add a new sensor that already exists.
-            # We only try to update the state for sensors in AMS_DEVICES
-            if sensor_name not in LICZNIK_DEVICES:
-                LICZNIK_DEVICES.add(sensor_name)
-                if sensor_name in LICZNIK_SENSOR_CREATED_BUT_NOT_READ:
+            # We only try to update the state for sensors in hub.devices
+            if sensor_name not in hub.devices:
+                hub.devices.add(sensor_name)
+                if sensor_name in hub.sensor_created_but_not_read:
                     # The hourly sensors is added manually at the start.
                     continue
 
+                reading = data[sensor_name]
                 sensor_states = {
                     "name": sensor_name,
-                    "state": data.get(sensor_name, {}).get("state"),
-                    "attributes": data.get(sensor_name, {}).get("attributes"),
+                    "state": reading.state,
+                    "attributes": reading.attributes,
                 }
-                sensors.append(LicznikSensor(hass, sensor_states))
+                sensors.append(LicznikSensor(hass, hub, sensor_states))
 
         # Handle the hourly sensors.
         """
         for hourly in HOURLY_SENSORS:
-            if hourly not in data and hourly not in LICZNIK_SENSOR_CREATED_BUT_NOT_READ:
-                LICZNIK_SENSOR_CREATED_BUT_NOT_READ.add(hourly)
+            if hourly not in data and hourly not in hub.sensor_created_but_not_read:
+                hub.sensor_created_but_not_read.add(hourly)
                 _LOGGER.debug(
                     "Hourly sensor %s added so we can attempt to restore state", hourly
                 )
@@ -59,14 +73,23 @@ async def async_setup_entry(hass, config_entry, async_add_devices):
                     "state": data.get(hourly, {}).get("state"),
                     "attributes": data.get(hourly, {}).get("attributes"),
                 }
-                sensors.append(LicznikSensor(hass, sensor_states))
+                sensors.append(LicznikSensor(hass, hub, sensor_states))
         """
 
         if len(sensors):
             _LOGGER.debug("Trying to add %s sensors", len(sensors))
             async_add_devices(sensors)
 
-    async_dispatcher_connect(hass, SIGNAL_NEW_TELEGRAM_SENSOR, async_add_sensor)
+    hub.listeners.append(
+        async_dispatcher_connect(
+            hass, SIGNAL_NEW_TELEGRAM_SENSOR.format(hub.hub_id), async_add_sensor
+        )
+    )
+    # the readout metrics and connection sensors exist from the start, they do not wait for a telegram
+    async_add_devices(
+        [LicznikMetricSensor(hub, name) for name in METRICS]
+        + [LicznikConnectionSensor(hub, kind) for kind in CONNECTION_SENSORS]
+    )
 
     return True
 
@@ -81,17 +104,20 @@ async def async_remove_entry(hass, entry):
         pass
 
 
-class LicznikSensor(RestoreEntity):
+class LicznikSensor(SensorEntity, RestoreEntity):
     """Representation of a AMS sensor."""
 
-    def __init__(self, hass, sensor_states):
+    def __init__(self, hass, hub, sensor_states):
         """Initialize the Serial sensor."""
-        self.ams = hass.data[DOMAIN]
+        self.ams = hub
         self._hass = hass
         self._name = sensor_states.get("name")
         self._meter_id = self.ams.meter_serial
         self._state = None
         self._attributes = {}
+        self._unit = None
+        self._state_class = None
+        self._device_class = None
         self._update_properties()
         _LOGGER.debug("Init %s DUMP sensor_states %s", self._name, sensor_states)
 
@@ -99,9 +125,15 @@ class LicznikSensor(RestoreEntity):
         """Update all portions of sensor."""
         _LOGGER.debug("Update all portions of sensor.")
         try:
-            self._state = self.ams.sensor_data[self._name].get("state")
-            self._attributes = self.ams.sensor_data[self._name].get("attributes")
-            self._meter_id = self.ams.meter_serial
+            reading = self.ams.sensor_data[self._name]
+            self._state = reading.state
+            self._attributes = reading.attributes
+            self._unit = reading.unit or None
+            if reading.info is not None:
+                self._state_class = reading.info.state_class
+                self._device_class = reading.info.device_class
+            # meters on a multidrop bus each have their own serial
+            self._meter_id = reading.identity.serial
             _LOGGER.debug("Updating sensor %s", self._name)
         except KeyError:
             pass
@@ -119,19 +151,38 @@ class LicznikSensor(RestoreEntity):
     @property
     def should_poll(self) -> bool:
         """No polling needed."""
-        #return False
-        return True
+        return False
 
     @property
-    def device_state_attributes(self):
+    def extra_state_attributes(self):
         """Return the attributes of the entity (if any JSON present)."""
         return self._attributes
 
     @property
-    def state(self):
+    def native_value(self):
         """Return the state of the sensor."""
         return self._state
 
+    @property
+    def native_unit_of_measurement(self):
+        """Return the unit the meter sent."""
+        return self._unit
+
+    @property
+    def state_class(self):
+        """Return the state class, the recorder keeps statistics of measurements and totals."""
+        return self._state_class
+
+    @property
+    def device_class(self):
+        """Return the device class of the register."""
+        return self._device_class
+
+    @property
+    def icon(self):
+        """Return the icon."""
+        return "mdi:gauge"
+
     @property
     def device_info(self) -> dict:
         """Return the device info."""
@@ -139,13 +190,21 @@ class LicznikSensor(RestoreEntity):
             "name": self.name,
             "identifiers": {(DOMAIN, self.unique_id)},
             "manufacturer": self.ams.meter_manufacturer,
-            "model": self.ams.meter_type,
+            "model": self.ams.sensor_data[self._name].identity.type
+            if self._name in self.ams.sensor_data
+            else self.ams.meter_type,
         }
 
     async def async_added_to_hass(self):
         """Register callbacks and restoring states to hourly sensors."""
         await super().async_added_to_hass()
-        async_dispatcher_connect(self._hass, SIGNAL_UPDATE_TELEGRAM, self._update_callback)
+        self.async_on_remove(
+            async_dispatcher_connect(
+                self._hass,
+                SIGNAL_UPDATE_TELEGRAM.format(self.ams.hub_id, self._name),
+                self._update_callback,
+            )
+        )
         old_state = await self.async_get_last_state()
 
         if old_state is not None and self._name:
@@ -167,7 +226,11 @@ class LicznikSensor(RestoreEntity):
                         old_state.attributes,
                     )
                     self._state = old_state.state
-                    self._attributes = old_state.attributes
+                    self._attributes = {
+                        key: value
+                        for key, value in old_state.attributes.items()
+                        if key not in ENTITY_PROPERTIES
+                    }
                     self.async_write_ha_state()
             else:
                 # I'll rather have unknown then wrong values.
@@ -181,7 +244,144 @@ class LicznikSensor(RestoreEntity):
 
     @callback
     def _update_callback(self):
-        """Update the state."""
-        if self._name in LICZNIK_DEVICES:
-            self._update_properties()
-            self.async_write_ha_state()
\ No newline at end of file
+        """Update the state after the register changed."""
+        self._update_properties()
+        self.async_write_ha_state()
+
+class LicznikMetricSensor(Entity):
+    """Diagnostic sensor showing one readout cycle metric of a hub."""
+
+    def __init__(self, hub, metric):
+        """Initialize the metric sensor."""
+        self.ams = hub
+        self._metric = metric
+        self._info = METRICS[metric]
+
+    @property
+    def unique_id(self) -> str:
+        """Return the unique id of the sensor."""
+        return f"{self._metric}___{self.ams.hub_id}"
+
+    @property
+    def name(self) -> str:
+        """Return the name of the sensor."""
+        return f"{DOMAIN} {self.ams.hub_id} {self._info.description}"
+
+    @property
+    def should_poll(self) -> bool:
+        """Updated after every readout cycle."""
+        return False
+
+    @property
+    def entity_category(self):
+        """Keep the metric out of the default dashboards."""
+        return EntityCategory.DIAGNOSTIC
+
+    @property
+    def unit_of_measurement(self):
+        """Return the unit of the metric."""
+        return self._info.unit or None
+
+    @property
+    def state(self):
+        """Return the value of the last cycle."""
+        last = self.ams.metrics.histograms[self._metric].last
+        return round(last, 4) if last is not None else None
+
+    @property
+    def extra_state_attributes(self):
+        """Return the summary and histogram of the metric."""
+        histogram = self.ams.metrics.histograms[self._metric]
+        attributes = histogram.as_dict()
+        if self._info.unit == "s" and histogram.count:
+            # readable without knowing the magnitude, 350 ms rather than 0.35
+            for key in ("last", "mean", "min", "max"):
+                attributes[key] = self.ams.format_time(attributes[key])
+        attributes["cycles"] = self.ams.metrics.cycles
+        attributes["failed_cycles"] = self.ams.metrics.failed_cycles
+        return attributes
+
+    @property
+    def device_info(self) -> dict:
+        """Group the metrics of a hub on one device."""
+        return {
+            "name": f"{DOMAIN} {self.ams.hub_id}",
+            "identifiers": {(DOMAIN, self.ams.hub_id)},
+            "manufacturer": self.ams.meter_manufacturer,
+        }
+
+    async def async_added_to_hass(self):
+        """Register the update callback."""
+        self.async_on_remove(
+            async_dispatcher_connect(
+                self.hass,
+                SIGNAL_METRICS_UPDATE.format(self.ams.hub_id),
+                self.async_write_ha_state,
+            )
+        )
+
+
+class LicznikConnectionSensor(Entity):
+    """Diagnostic sensor showing the connection state or reconnect count of a hub."""
+
+    def __init__(self, hub, kind):
+        """Initialize the connection sensor."""
+        self.ams = hub
+        self._kind = kind
+
+    @property
+    def unique_id(self) -> str:
+        """Return the unique id of the sensor."""
+        return f"{self._kind}___{self.ams.hub_id}"
+
+    @property
+    def name(self) -> str:
+        """Return the name of the sensor."""
+        return f"{DOMAIN} {self.ams.hub_id} {CONNECTION_SENSORS[self._kind]}"
+
+    @property
+    def should_poll(self) -> bool:
+        """Updated when the connection changes."""
+        return False
+
+    @property
+    def entity_category(self):
+        """Keep the sensor out of the default dashboards."""
+        return EntityCategory.DIAGNOSTIC
+
+    @property
+    def state(self):
+        """Return the connection state or the number of reconnects."""
+        supervisor = self.ams.supervisor
+        if self._kind == "reconnects":
+            return supervisor.reconnects
+        return supervisor.state
+
+    @property
+    def extra_state_attributes(self):
+        """Return the port and the recent failures."""
+        supervisor = self.ams.supervisor
+        return {
+            "port": supervisor.path,
+            "failures": supervisor.failures,
+            "last_error": supervisor.last_error,
+        }
+
+    @property
+    def device_info(self) -> dict:
+        """Group the connection sensors with the metrics of the hub."""
+        return {
+            "name": f"{DOMAIN} {self.ams.hub_id}",
+            "identifiers": {(DOMAIN, self.ams.hub_id)},
+            "manufacturer": self.ams.meter_manufacturer,
+        }
+
+    async def async_added_to_hass(self):
+        """Register the update callback."""
+        self.async_on_remove(
+            async_dispatcher_connect(
+                self.hass,
+                SIGNAL_CONNECTION_UPDATE.format(self.ams.hub_id),
+                self.async_write_ha_state,
+            )
+        )
@@ -0,0 +1,141 @@
+"""
+Persistent reading buffer.
+
+Every intact telegram appends the numeric registers that changed to a small
+SQLite database in the Home Assistant configuration directory. Rows older
+than the retention are dropped once an hour. The buffered cumulative energy
+readings are turned into hourly statistics when the recorder missed them.
+"""
+import sqlite3
+import threading
+
+HOUR = 3600
+# seconds between two deletions of rows past the retention
+PRUNE_EVERY = HOUR
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS registers ("
+    " id INTEGER PRIMARY KEY,"
+    " name TEXT NOT NULL,"
+    " serial TEXT NOT NULL,"
+    " unit TEXT NOT NULL,"
+    " cumulative INTEGER NOT NULL,"
+    " UNIQUE (name, serial))",
+    # one row per register and second, the register id keeps rows small
+    "CREATE TABLE IF NOT EXISTS readings ("
+    " register INTEGER NOT NULL,"
+    " ts INTEGER NOT NULL,"
+    " value REAL NOT NULL,"
+    " PRIMARY KEY (register, ts)) WITHOUT ROWID",
+)
+
+
+class ReadingStore:
+    """Append-only SQLite buffer of register values with bounded retention."""
+
+    def __init__(self, path, retention):
+        """Initialize the store, retention is in seconds. The file is opened on first use."""
+        self.path = path
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._db = None
+        self._closed = False
+        # (name, serial) -> register id
+        self._registers = {}
+        self._pruned = 0
+
+    def _connect(self):
+        """Open the database and create the tables."""
+        if self._db is None:
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            # appends must not block readers, a lost last second is acceptable
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                db.execute(statement)
+            self._registers = {
+                (name, serial): register
+                for register, name, serial in db.execute("SELECT id, name, serial FROM registers")
+            }
+            self._db = db
+        return self._db
+
+    def _register(self, db, name, serial, unit, cumulative):
+        """Return the id of a register, adding it on first sight."""
+        register = self._registers.get((name, serial))
+        if register is None:
+            register = db.execute(
+                "INSERT INTO registers (name, serial, unit, cumulative) VALUES (?, ?, ?, ?)",
+                (name, serial, unit, int(cumulative)),
+            ).lastrowid
+            self._registers[(name, serial)] = register
+        return register
+
+    def append(self, timestamp, rows):
+        """Store the (name, serial, value, unit, cumulative) rows of one telegram."""
+        timestamp = int(timestamp)
+        with self._lock:
+            if self._closed:
+                return
+            db = self._connect()
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO readings (register, ts, value) VALUES (?, ?, ?)",
+                    [
+                        (self._register(db, name, serial, unit, cumulative), timestamp, value)
+                        for name, serial, value, unit, cumulative in rows
+                    ],
+                )
+                if timestamp - self._pruned >= PRUNE_EVERY:
+                    self._pruned = timestamp
+                    db.execute("DELETE FROM readings WHERE ts < ?", (timestamp - self.retention,))
+
+    def cumulative_registers(self):
+        """Return (name, serial, unit) of the buffered cumulative registers."""
+        with self._lock:
+            if self._closed:
+                return []
+            return self._connect().execute(
+                "SELECT name, serial, unit FROM registers WHERE cumulative"
+            ).fetchall()
+
+    def hourly(self, name, serial, start, end):
+        """Return (hour, value) of the last reading in every hour from start up to end."""
+        with self._lock:
+            if self._closed:
+                return []
+            db = self._connect()
+            register = self._registers.get((name, serial))
+            if register is None:
+                return []
+            # SQLite takes the bare value column from the row holding MAX(ts)
+            return [
+                (hour, value)
+                for hour, value, _ in db.execute(
+                    "SELECT ts / ? * ?, value, MAX(ts) FROM readings"
+                    " WHERE register = ? AND ts >= ? AND ts < ? GROUP BY ts / ? ORDER BY 1",
+                    (HOUR, HOUR, register, int(start), int(end), HOUR),
+                )
+            ]
+
+    def close(self):
+        """Close the database, later appends are dropped."""
+        with self._lock:
+            self._closed = True
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def hourly_sums(hours, state=None, total=0.0):
+    """
+    Yield (hour, state, sum) statistics of a cumulative register.
+
+    state and total continue the last statistic the recorder has, a reading
+    lower than the one before is a meter reset and counts from zero.
+    """
+    for hour, value in hours:
+        if state is not None:
+            total += value - state if value >= state else value
+        state = value
+        yield hour, state, total
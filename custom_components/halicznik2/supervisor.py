@@ -0,0 +1,97 @@
+"""
+Connection supervision.
+
+Tracks whether the port of a hub is open and decides when to try again
+after it failed: exponential backoff with jitter, so several hubs whose
+adapters vanished together do not retry in lockstep. A USB adapter is
+reopened through its /dev/serial/by-id link, which follows the adapter
+when it comes back under another ttyUSB number.
+"""
+import os
+import random
+
+from .network import is_url
+
+BY_ID = "/dev/serial/by-id"
+
+# seconds before the first retry and the most a retry waits
+BACKOFF_MIN = 1
+BACKOFF_MAX = 300
+BACKOFF_FACTOR = 2
+
+STATE_CONNECTING = "connecting"
+STATE_CONNECTED = "connected"
+STATE_DISCONNECTED = "disconnected"
+
+
+def get_serial_by_id(dev_path):
+    """Return a /dev/serial/by-id match for given device if available."""
+    if not os.path.isdir(BY_ID):
+        return dev_path
+
+    for path in (entry.path for entry in os.scandir(BY_ID) if entry.is_symlink()):
+        if os.path.realpath(path) == dev_path:
+            return path
+    return dev_path
+
+
+class ConnectionSupervisor:
+    """Connection state, reconnect count and backoff of one port."""
+
+    def __init__(self, port, seed=None):
+        """Initialize the supervisor for the configured port."""
+        self.port = port
+        # what was opened last, the by-id link of a USB adapter
+        self.path = port
+        self.state = STATE_DISCONNECTED
+        # successful opens after the first one
+        self.reconnects = 0
+        # failures since the port last delivered data
+        self.failures = 0
+        self.last_error = None
+        self._by_id = None
+        self._opened = False
+        self._random = random.Random(seed)
+
+    def resolve(self):
+        """Return the path to open, the by-id link of the adapter once it is known."""
+        if is_url(self.port):
+            return self.port
+        if self._by_id is None:
+            path = get_serial_by_id(os.path.realpath(self.port))
+            if path.startswith(BY_ID):
+                self._by_id = path
+        if self._by_id is not None and os.path.exists(self._by_id):
+            self.path = self._by_id
+        else:
+            self.path = self.port
+        return self.path
+
+    def connecting(self):
+        """Note an attempt to open the port."""
+        self.state = STATE_CONNECTING
+
+    def connected(self):
+        """Note that the port was opened."""
+        if self._opened:
+            self.reconnects += 1
+        self._opened = True
+        self.state = STATE_CONNECTED
+
+    def failed(self, error):
+        """Note that opening or using the port failed."""
+        self.state = STATE_DISCONNECTED
+        self.failures += 1
+        self.last_error = str(error)
+
+    def healthy(self):
+        """Note that the port delivered data, the backoff starts over."""
+        self.failures = 0
+
+    def delay(self):
+        """Return the seconds to wait before the next attempt, 0 without failures."""
+        if not self.failures:
+            return 0.0
+        ceiling = min(BACKOFF_MAX, BACKOFF_MIN * BACKOFF_FACTOR ** (self.failures - 1))
+        # half fixed, half random keeps a lower bound on the wait
+        return self._random.uniform(ceiling / 2, ceiling)
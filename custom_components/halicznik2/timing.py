@@ -0,0 +1,73 @@
+"""
+IEC 62056-21 protocol timing.
+
+Waits are deadlines derived from the limits of the standard and the current
+baudrate instead of fixed sleeps:
+
+    200 ms <= tr <= 1500 ms  reaction time between a message and its answer
+    ta < 1500 ms             time between two characters of a message
+    1500 ms < tt <= 2200 ms  the meter waits this long for the ACK
+
+The reader has to leave at least tr between the identification message and
+its ACK. Some meters need longer, MeterTiming learns the shortest turnaround
+each meter accepts. A missed ACK raises the lowest allowed turnaround by a
+step, a long run of answered ones lowers it again.
+"""
+
+TR_MIN = 0.2
+TR_MAX = 1.5
+TA_MAX = 1.5
+TT_MIN = 1.5
+
+# 7E1: start bit, 7 data bits, parity, stop bit
+BITS_PER_CHARACTER = 10
+# slack on top of computed times, covers the latency of USB serial adapters
+MARGIN = 0.02
+# the learned turnaround moves in steps of this size
+TURNAROUND_STEP = 0.05
+# the ACK has to go out before the meter stops waiting for it
+TURNAROUND_MAX = TT_MIN - 2 * MARGIN
+# answered ACKs in a row before the lowest allowed turnaround drops a step
+FLOOR_DECAY_CYCLES = 20
+
+
+def transmit_time(size, baudrate):
+    """Return the seconds it takes to send size characters."""
+    return size * BITS_PER_CHARACTER / baudrate
+
+
+def response_timeout(request_size, baudrate):
+    """Return the seconds from writing a request until its answer has to begin."""
+    return transmit_time(request_size, baudrate) + TR_MAX + MARGIN
+
+
+class MeterTiming:
+    """Turnaround and response times observed for one meter."""
+
+    def __init__(self):
+        """Start at the shortest turnaround the standard allows."""
+        self.turnaround = TR_MIN + MARGIN
+        self.response_time = None
+        self._floor = self.turnaround
+        self._answered = 0
+
+    def observe_response(self, seconds):
+        """Record how long the meter took to start answering a request."""
+        if self.response_time is None or seconds < self.response_time:
+            self.response_time = seconds
+
+    def acknowledge_done(self, answered):
+        """Adjust the turnaround after an ACK, answered tells if the meter reacted to it."""
+        if answered:
+            self._answered += 1
+            if self._answered >= FLOOR_DECAY_CYCLES:
+                # a miss may have been line noise, try a shorter turnaround again
+                self._answered = 0
+                self._floor = max(TR_MIN + MARGIN, self._floor - TURNAROUND_STEP)
+            # creep back towards the shortest turnaround that worked
+            self.turnaround = max(self._floor, self.turnaround - TURNAROUND_STEP)
+            return
+        # the meter was not listening yet, raise the floor a step and back off for now
+        self._answered = 0
+        self._floor = min(self._floor + TURNAROUND_STEP, TURNAROUND_MAX)
+        self.turnaround = min(max(self._floor, 2 * self.turnaround), TURNAROUND_MAX)
@@ -0,0 +1,53 @@
+"""
+Protocol trace.
+
+A bounded ring buffer of what went over the wire and what the readout made
+of it. Recording only appends a tuple holding references to the raw bytes;
+formatting waits until the trace is dumped through the dump_trace service or
+the diagnostics download. A trace of size 0 is disabled, and hot paths check
+enabled before building anything.
+"""
+import json
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+# kinds of trace events
+TX = "tx"
+RX = "rx"
+EVENT = "event"
+
+
+def escape(data):
+    """Return bytes as ASCII with control characters escaped, STX shows as \\x02."""
+    return data.decode("latin-1").encode("unicode_escape").decode("ascii")
+
+
+class ProtocolTrace:
+    """Ring buffer of the last size protocol events of a hub."""
+
+    def __init__(self, size):
+        """Initialize the trace, size 0 disables it."""
+        self.enabled = size > 0
+        self._events = deque(maxlen=size or 1)
+
+    def record(self, kind, data=b"", note=""):
+        """Append an event, data is kept as is and only formatted on dump."""
+        self._events.append((time.time(), kind, data, note))
+
+    def dump(self):
+        """Return the events, oldest first, as JSON serializable dicts."""
+        return [
+            {
+                "time": datetime.fromtimestamp(timestamp, timezone.utc).isoformat(),
+                "kind": kind,
+                "data": escape(data) if data else "",
+                "note": str(note),
+            }
+            for timestamp, kind, data, note in list(self._events)
+        ]
+
+    def write(self, path):
+        """Write the dump to a JSON file."""
+        with open(path, "w") as file:
+            json.dump(self.dump(), file, indent=1)
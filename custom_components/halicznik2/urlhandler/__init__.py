@@ -0,0 +1 @@
+"""pyserial URL handlers, see capture.register_url_handlers."""
@@ -0,0 +1,113 @@
+"""
+replay:// URL handler for pyserial.
+
+URL format: replay:///path/to/capture.d0cap[?speed=<factor>][&loop]
+"""
+import time
+import urllib.parse as urlparse
+
+from serial.serialutil import SerialBase, SerialException, portNotOpenError
+
+from ..capture import Replayer, read_capture
+
+
+class Serial(SerialBase):
+    """Serial port that plays back the meter side of a capture file."""
+
+    def __init__(self, *args, **kwargs):
+        """Initialize the port."""
+        self._replayer = None
+        self._buffer = bytearray()
+        super().__init__(*args, **kwargs)
+
+    def open(self):
+        """Load the capture named in the URL."""
+        if self.is_open:
+            raise SerialException("Port is already open.")
+        if self._port is None:
+            raise SerialException("Port must be configured before it can be used.")
+        path, speed, loop = self.from_url(self.port)
+        try:
+            records = list(read_capture(path))
+        except (OSError, ValueError) as exc:
+            raise SerialException("Could not open capture {}: {}".format(path, exc))
+        self._replayer = Replayer(records, speed, loop, time.monotonic())
+        self._buffer = bytearray()
+        self.is_open = True
+
+    def from_url(self, url):
+        """Return (path, speed, loop) from the URL."""
+        parts = urlparse.urlsplit(url)
+        if parts.scheme != "replay":
+            raise SerialException(
+                'expected a string in the form "replay:///path[?speed=N][&loop]": '
+                "not starting with replay:// ({!r})".format(parts.scheme)
+            )
+        options = urlparse.parse_qs(parts.query, True)
+        try:
+            speed = float(options.get("speed", ["1"])[0])
+        except ValueError as exc:
+            raise SerialException("invalid speed: {}".format(exc))
+        return parts.netloc + parts.path, speed, "loop" in options
+
+    def _reconfigure_port(self):
+        """Baudrate and framing do not matter for a replay."""
+
+    def close(self):
+        """Close the port."""
+        self.is_open = False
+        self._replayer = None
+
+    def _pump(self):
+        """Move the bytes that are due into the input buffer."""
+        self._buffer += self._replayer.due(time.monotonic())
+
+    @property
+    def in_waiting(self):
+        """Return the number of bytes that already arrived."""
+        if not self.is_open:
+            raise portNotOpenError
+        self._pump()
+        return len(self._buffer)
+
+    def read(self, size=1):
+        """Read size bytes, waiting for them until the timeout expires."""
+        if not self.is_open:
+            raise portNotOpenError
+        deadline = None if self._timeout is None else time.monotonic() + self._timeout
+        while True:
+            self._pump()
+            if len(self._buffer) >= size:
+                break
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                break
+            wake = self._replayer.next_due()
+            if wake is None:
+                if deadline is None:
+                    raise SerialException("capture exhausted")
+                wake = deadline
+            elif deadline is not None:
+                wake = min(wake, deadline)
+            time.sleep(max(0.0, wake - now))
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def write(self, data):
+        """Hand the written bytes to the replayer."""
+        if not self.is_open:
+            raise portNotOpenError
+        self._replayer.written(bytes(data), time.monotonic())
+        return len(data)
+
+    def reset_input_buffer(self):
+        """Drop bytes that arrived but were not read."""
+        self._pump()
+        del self._buffer[:]
+
+    def reset_output_buffer(self):
+        """Nothing is buffered on output."""
+
+    def flush(self):
+        """Nothing is buffered on output."""